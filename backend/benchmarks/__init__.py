@@ -0,0 +1,89 @@
+'''
+Benchmarks and load tests for the trivia API
+
+    python -m benchmarks.seed --questions 100000 --database-url postgresql://localhost/trivia_bench
+    python -m benchmarks.routes --database-url postgresql://localhost/trivia_bench --output before.json
+    python -m benchmarks.quiz_load http://localhost:5000 --players 200 --output load.json
+    python -m benchmarks.compare before.json after.json
+
+Every runner prints (or writes with --output) JSON results tagged with the
+commit, database and data volume, so runs from different commits can be
+compared with benchmarks.compare.
+'''
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def add_database_args(parser):
+    parser.add_argument('--database-url', default=None,
+                        help='database to use (default: SQLite in the temp directory)')
+    parser.add_argument('--output', default=None, help='write the JSON results to this file')
+
+
+def database_url(args):
+    return args.database_url or 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'trivia_bench.db')
+
+
+def database_backend(url):
+    return url.split(':', 1)[0].split('+', 1)[0]
+
+
+def percentile(timings, fraction):
+    # timings must be sorted
+    if not timings:
+        return None
+    return round(timings[min(len(timings) - 1, int(len(timings) * fraction))], 3)
+
+
+def summarize(timings, elapsed, errors=0):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(timings) / elapsed, 1) if elapsed else None,
+        'p50_ms': percentile(timings, 0.50),
+        'p95_ms': percentile(timings, 0.95),
+        'p99_ms': percentile(timings, 0.99)
+    }
+
+
+def peak_rss_mb(pid=None):
+    # peak resident set size of this process, or of another one on Linux
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+    with open('/proc/{}/status'.format(pid)) as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return round(int(line.split()[1]) / 1024, 1)
+    return None
+
+
+def environment(**extra):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return dict(commit=commit, python=platform.python_version(), machine=platform.machine(), **extra)
+
+
+def write_results(results, output=None):
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print(text)
@@ -0,0 +1,93 @@
+'''
+Adaptive quiz benchmark - draw latency by bank size
+
+    python -m benchmarks.adaptive_quiz --sizes 10000 100000 1000000
+
+Seeds each bank size in turn and plays simulated adaptive quizzes, where
+each player answers correctly with --accuracy probability and the band
+moves with target_difficulty(). Times each draw from the per-difficulty
+index against an ORDER BY random() query per band; the index draw should
+stay flat as the bank grows.
+'''
+import argparse
+import random
+import time
+
+from sqlalchemy.sql.expression import func
+
+from benchmarks import add_database_args, database_backend, database_url, environment, summarize, \
+    write_results
+from benchmarks.seed import seed
+from flaskr import create_app
+from flaskr.quiz import difficulty_bands, draw_adaptive_question, question_index, target_difficulty
+from models import Question
+
+CATEGORIES = 6
+
+
+def order_by_random_band(category, previous, difficulty):
+    # the query-per-band approach the index replaces
+    for band in difficulty_bands(difficulty):
+        query = Question.query.filter(Question.difficulty == band, ~Question.id.in_(previous))
+        if category:
+            query = query.filter(Question.category == category)
+        question = query.order_by(func.random()).first()
+        if question is not None:
+            return question, band
+    return None, None
+
+
+def time_adaptive_draws(draw, quizzes, accuracy, quiz_length=10):
+    timings = []
+    started = time.perf_counter()
+    for quiz in range(quizzes):
+        category = random.randint(0, CATEGORIES)
+        previous, answers, difficulty = set(), [], 3
+        for step in range(quiz_length):
+            difficulty = target_difficulty(difficulty, answers)
+            draw_started = time.perf_counter()
+            question, band = draw(category, previous, difficulty)
+            timings.append((time.perf_counter() - draw_started) * 1000)
+            if question is None:
+                break
+            previous.add(question.id)
+            answers.append(random.random() < accuracy)
+    return summarize(timings, time.perf_counter() - started)
+
+
+def run(sizes, url, quizzes, accuracy):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': url})
+    results = []
+    with app.app_context():
+        for size in sizes:
+            seed(size, CATEGORIES)
+            question_index.reset()
+
+            started = time.perf_counter()
+            question_index.ensure_loaded(0)
+            index_load_ms = (time.perf_counter() - started) * 1000
+
+            results.append({
+                'questions': size,
+                'order_by_random': time_adaptive_draws(order_by_random_band, quizzes, accuracy),
+                'index': time_adaptive_draws(draw_adaptive_question, quizzes, accuracy),
+                'index_load_ms': round(index_load_ms, 1)
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--quizzes', type=int, default=20)
+    parser.add_argument('--accuracy', type=float, default=0.7)
+    add_database_args(parser)
+    args = parser.parse_args()
+
+    url = database_url(args)
+    write_results(environment(database=database_backend(url), accuracy=args.accuracy,
+                              results=run(args.sizes, url, args.quizzes, args.accuracy)), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+'''
+Compare two benchmark result files
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Prints p50/p95/p99 latency and throughput side by side for every route (or
+the single load test) in both files, with the change in percent. Exits with
+status 1 when any p95 got slower, or throughput dropped, by more than
+--threshold percent, so it can gate a CI job.
+'''
+import argparse
+import json
+import sys
+
+METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'requests_per_second')
+
+
+def load(path):
+    with open(path) as results:
+        results = json.load(results)
+    # route benchmarks nest their summaries, a load test is a single summary
+    return results, results.get('routes', {'load': results})
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) * 100.0 / before
+
+
+def compare(before, after, threshold):
+    regressions = []
+    rows = []
+    for name in sorted(set(before) & set(after)):
+        for metric in METRICS:
+            delta = change(before[name].get(metric), after[name].get(metric))
+            rows.append((name, metric, before[name].get(metric), after[name].get(metric), delta))
+            slower = delta is not None and (delta > threshold if metric == 'p95_ms' else
+                                            metric == 'requests_per_second' and delta < -threshold)
+            if slower:
+                regressions.append((name, metric, delta))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed regression in percent')
+    args = parser.parse_args()
+
+    before_run, before = load(args.before)
+    after_run, after = load(args.after)
+    rows, regressions = compare(before, after, args.threshold)
+
+    print('{} -> {}'.format(before_run.get('commit'), after_run.get('commit')))
+    print('{:<24} {:<20} {:>12} {:>12} {:>9}'.format('benchmark', 'metric', 'before', 'after', 'change'))
+    for name, metric, old, new, delta in rows:
+        print('{:<24} {:<20} {:>12} {:>12} {:>9}'.format(
+            name, metric, old, new, '' if delta is None else '{:+.1f}%'.format(delta)))
+
+    for name, metric, delta in regressions:
+        print('REGRESSION {} {} {:+.1f}%'.format(name, metric, delta))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
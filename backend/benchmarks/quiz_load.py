@@ -0,0 +1,123 @@
+'''
+Concurrent quiz player load test against a running server
+
+    # one sync worker
+    gunicorn -w 1 --threads 8 -b :5000 'flaskr:create_app()'
+    python -m benchmarks.quiz_load http://localhost:5000 --players 200
+
+    # one async worker
+    uvicorn --workers 1 --port 5001 asgi:app
+    python -m benchmarks.quiz_load http://localhost:5001 --players 200
+
+Each player plays quizzes of --quiz-length questions in a random category
+for --duration seconds, over its own keep-alive connection - through
+POST /quizzes sending the previous questions (--mode previous, the
+default) or through a quiz session (--mode session). Reports requests per
+second, latency percentiles and, given --server-pid, the server's peak RSS.
+'''
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+from benchmarks import environment, peak_rss_mb, summarize, write_results
+
+
+class Player(threading.Thread):
+
+    def __init__(self, url, mode, categories, quiz_length, deadline):
+        super().__init__(daemon=True)
+        self.url = url
+        self.mode = mode
+        self.categories = categories
+        self.quiz_length = quiz_length
+        self.deadline = deadline
+        self.timings = []
+        self.errors = 0
+
+    def post(self, connection, path, payload):
+        started = time.perf_counter()
+        connection.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        body = response.read()
+        self.timings.append((time.perf_counter() - started) * 1000)
+        return response.status, body
+
+    def connect(self):
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=30)
+
+    def play(self, connection, category):
+        # one quiz - 404 means the category ran out of questions
+        if self.mode == 'session':
+            status, body = self.post(connection, '/quizzes/sessions', {'quiz_category': {'id': category}})
+            if status != 200:
+                return status
+            path = '/quizzes/sessions/{}/next'.format(json.loads(body)['session'])
+
+        previous = []
+        for step in range(self.quiz_length):
+            if self.mode == 'session':
+                status, body = self.post(connection, path, {})
+            else:
+                status, body = self.post(connection, '/quizzes', {
+                    'previous_questions': previous,
+                    'quiz_category': {'id': category}
+                })
+            if status != 200:
+                return status
+            previous.append(json.loads(body)['question']['id'])
+        return 200
+
+    def run(self):
+        connection = self.connect()
+        while time.monotonic() < self.deadline:
+            try:
+                status = self.play(connection, random.choice(self.categories))
+            except (OSError, http.client.HTTPException):
+                status = None
+                connection.close()
+                connection = self.connect()
+            if status not in (200, 404):
+                self.errors += 1
+        connection.close()
+
+
+def run(base_url, mode, players, duration, quiz_length, categories, server_pid=None):
+    url = urllib.parse.urlparse(base_url)
+    deadline = time.monotonic() + duration
+    threads = [Player(url, mode, categories, quiz_length, deadline) for player in range(players)]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    timings = [timing for thread in threads for timing in thread.timings]
+    return environment(url=base_url, mode=mode, players=players, quiz_length=quiz_length,
+                       server_peak_rss_mb=peak_rss_mb(server_pid) if server_pid else None,
+                       **summarize(timings, elapsed, sum(thread.errors for thread in threads)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('url')
+    parser.add_argument('--mode', choices=['previous', 'session'], default='previous')
+    parser.add_argument('--players', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--quiz-length', type=int, default=10)
+    parser.add_argument('--categories', type=int, nargs='+', default=[0, 1, 2, 3, 4, 5, 6])
+    parser.add_argument('--server-pid', type=int, default=None, help='report this process\'s peak RSS (Linux)')
+    parser.add_argument('--output', default=None, help='write the JSON results to this file')
+    args = parser.parse_args()
+
+    write_results(run(args.url, args.mode, args.players, args.duration, args.quiz_length, args.categories,
+                      args.server_pid), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+'''
+Quiz selection benchmark - ORDER BY random() versus the in-memory index
+
+    python -m benchmarks.quiz_selection --sizes 10000 100000 1000000
+
+Seeds a scratch database (SQLite by default, or --database-url) with each
+bank size in turn and times single quiz draws through both paths, with the
+previous-question list growing over a 10 question quiz as the frontend sends it.
+'''
+import argparse
+import json
+import random
+import statistics
+import time
+
+from sqlalchemy.sql.expression import func
+
+from benchmarks import database_url
+from benchmarks.seed import seed
+from flaskr import create_app
+from flaskr.quiz import draw_questions, question_index
+from models import Question
+
+CATEGORIES = 6
+
+
+def order_by_random(category, previous):
+    query = Question.query.filter(~Question.id.in_(previous))
+    if category:
+        query = query.filter(Question.category == category)
+    return query.order_by(func.random()).first()
+
+
+def index_draw(category, previous):
+    # one question per draw, as a quiz without prefetching asks for it
+    return next(iter(draw_questions(category, previous, 1)), None)
+
+
+def time_draws(draw, quizzes, quiz_length=10):
+    timings = []
+    for quiz in range(quizzes):
+        category = random.randint(0, CATEGORIES)
+        previous = set()
+        for step in range(quiz_length):
+            started = time.perf_counter()
+            question = draw(category, previous)
+            timings.append((time.perf_counter() - started) * 1000)
+            if question is None:
+                break
+            previous.add(question.id)
+    timings.sort()
+    return {
+        'draws': len(timings),
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3)
+    }
+
+
+def run(sizes, url, quizzes):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': url})
+    results = []
+    with app.app_context():
+        for size in sizes:
+            seed(size, CATEGORIES)
+            question_index.reset()
+
+            started = time.perf_counter()
+            question_index.ensure_loaded(0)
+            index_load_ms = (time.perf_counter() - started) * 1000
+
+            results.append({
+                'questions': size,
+                'order_by_random': time_draws(order_by_random, quizzes),
+                'index': time_draws(index_draw, quizzes),
+                'index_load_ms': round(index_load_ms, 1)
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--database-url', default=None)
+    parser.add_argument('--quizzes', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.sizes, database_url(args), args.quizzes)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print('{:>10}  {:>22}  {:>22}  {:>14}'.format('questions', 'ORDER BY random() p50/p95', 'index p50/p95', 'index load'))
+    for result in results:
+        print('{:>10}  {:>14.3f} / {:<8.3f}  {:>14.3f} / {:<8.3f}  {:>11.1f} ms'.format(
+            result['questions'],
+            result['order_by_random']['p50_ms'], result['order_by_random']['p95_ms'],
+            result['index']['p50_ms'], result['index']['p95_ms'],
+            result['index_load_ms']))
+
+
+if __name__ == '__main__':
+    main()
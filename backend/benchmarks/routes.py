@@ -0,0 +1,221 @@
+'''
+Route micro-benchmarks through the Flask test client
+
+    python -m benchmarks.routes --questions 100000 --output before.json
+    python -m benchmarks.routes --database-url postgresql://localhost/trivia_bench --iterations 500
+
+Times each route handler in-process, with no network or WSGI server in the
+way, against the bound database (seeded first when --questions is given).
+The response cache is off unless --response-cache is passed, so every
+request does the handler's full work.
+
+The write routes (create, create_full, create_concurrent, delete,
+import_ndjson) add and remove their own questions, and whatever they added
+is deleted again at the end, so the database is left as seeded. Run them
+with and without --write-queue to compare plain and group commits - a
+create_concurrent request is CONCURRENT_WRITES creates sent at once.
+'''
+import argparse
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.sql.expression import func
+
+from benchmarks import add_database_args, database_backend, database_url, environment, peak_rss_mb, \
+    summarize, write_results
+from benchmarks.seed import seed, WORDS
+from flaskr import create_app
+from flaskr.pagination import encode_cursor
+from models import db, Question
+
+CONCURRENT_WRITES = 16
+IMPORT_SIZE = 100
+
+
+class RouteBench:
+    # the requests each benchmark sends, built from what is in the database
+
+    def __init__(self, client, total, categories):
+        self.client = client
+        self.total = total
+        self.categories = categories
+        self.ids = [row[0] for row in db.session.query(Question.id).limit(10000).all()]
+        self.session = None
+        # everything above this id was added by the write routes
+        self.max_id = db.session.query(func.max(Question.id)).scalar() or 0
+        self.deletable = []
+        self.pool = None
+
+    def categories_list(self):
+        return self.client.get('/categories')
+
+    def questions_first_page(self):
+        return self.client.get('/questions?page=1')
+
+    def questions_deep_page(self):
+        return self.client.get('/questions?page={}'.format(max(1, self.total // 10 - 1)))
+
+    def questions_cursor(self):
+        return self.client.get('/questions?limit=10&after={}'.format(encode_cursor(random.choice(self.ids))))
+
+    def category_questions(self):
+        return self.client.get('/categories/{}/questions'.format(random.randint(1, self.categories)))
+
+    def search(self):
+        return self.client.post('/questions', json={'searchTerm': random.choice(WORDS)})
+
+    def quiz(self):
+        return self.client.post('/quizzes', json={
+            'previous_questions': random.sample(self.ids, min(9, len(self.ids))),
+            'quiz_category': {'id': random.randint(0, self.categories)}
+        })
+
+    def quiz_batch(self):
+        # one request for a whole play of five questions
+        return self.client.post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': random.randint(0, self.categories)},
+            'count': 5
+        })
+
+    def quiz_adaptive(self):
+        return self.client.post('/quizzes', json={
+            'previous_questions': random.sample(self.ids, min(9, len(self.ids))),
+            'quiz_category': {'id': random.randint(0, self.categories)},
+            'adaptive': True,
+            'difficulty': random.randint(1, 5),
+            'recent_answers': [random.random() < 0.7 for answer in range(5)]
+        })
+
+    def quiz_session_next(self):
+        if self.session is None:
+            response = self.client.post('/quizzes/sessions', json={'quiz_category': {'id': 0}})
+            self.session = response.get_json()['session']
+        response = self.client.post('/quizzes/sessions/{}/next'.format(self.session))
+        if response.status_code == 404:
+            self.session = None
+        return response
+
+    def new_question(self):
+        return {
+            'question': ' '.join(random.sample(WORDS, 6)) + '?',
+            'answer': random.choice(WORDS),
+            'category': random.randint(1, self.categories),
+            'difficulty': random.randint(1, 5)
+        }
+
+    def create(self):
+        return self.client.post('/questions', json=self.new_question())
+
+    def create_full(self):
+        # the create plus a re-listed page
+        return self.client.post('/questions?full=1', json=self.new_question())
+
+    def create_concurrent(self):
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(CONCURRENT_WRITES)
+        app = self.client.application
+        responses = list(self.pool.map(lambda question: app.test_client().post('/questions', json=question),
+                                       [self.new_question() for write in range(CONCURRENT_WRITES)]))
+        return next((response for response in responses if response.status_code != 200), responses[-1])
+
+    def prepare_delete(self, count):
+        # rows to delete, added outside the timings
+        questions = [Question(**self.new_question()) for number in range(count)]
+        db.session.add_all(questions)
+        db.session.commit()
+        self.deletable = [question.id for question in questions]
+
+    def delete(self):
+        return self.client.delete('/questions/{}'.format(self.deletable.pop()))
+
+    def import_ndjson(self):
+        body = '\n'.join(json.dumps(self.new_question()) for number in range(IMPORT_SIZE))
+        return self.client.post('/questions/import', data=body, content_type='application/x-ndjson')
+
+    def export(self):
+        response = self.client.get('/questions/export')
+        # the body is streamed, so the work happens as it is read
+        response.get_data()
+        return response
+
+    def cleanup(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+        Question.query.filter(Question.id > self.max_id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+ROUTES = ['categories_list', 'questions_first_page', 'questions_deep_page', 'questions_cursor',
+          'category_questions', 'search', 'quiz', 'quiz_batch', 'quiz_adaptive', 'quiz_session_next',
+          'export', 'create', 'create_full', 'create_concurrent', 'delete', 'import_ndjson']
+
+
+def time_route(send, iterations, warmup):
+    for iteration in range(warmup):
+        send()
+
+    timings, errors = [], 0
+    started = time.perf_counter()
+    for iteration in range(iterations):
+        request_started = time.perf_counter()
+        response = send()
+        timings.append((time.perf_counter() - request_started) * 1000)
+        if response.status_code != 200:
+            errors += 1
+    return summarize(timings, time.perf_counter() - started, errors)
+
+
+def run(url, questions, categories, iterations, warmup, routes, response_cache, write_queue):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': url,
+        'DB_CREATE_ALL': False,
+        'RESPONSE_CACHE': 'memory' if response_cache else 'none',
+        'WRITE_QUEUE': write_queue
+    })
+    results = {}
+
+    with app.app_context():
+        if questions:
+            seed(questions, categories)
+        total = db.session.query(Question).count()
+        bench = RouteBench(app.test_client(), total, categories)
+
+        try:
+            for name in routes:
+                prepare = getattr(bench, 'prepare_' + name, None)
+                if prepare is not None:
+                    prepare(iterations + warmup)
+                results[name] = time_route(getattr(bench, name), iterations, warmup)
+        finally:
+            bench.cleanup()
+
+    return environment(database=database_backend(url), questions=total, categories=categories,
+                       iterations=iterations, response_cache=response_cache, write_queue=write_queue,
+                       routes=results, peak_rss_mb=peak_rss_mb())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=None, help='seed this many questions first')
+    parser.add_argument('--categories', type=int, default=6)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--routes', nargs='+', choices=ROUTES, default=ROUTES)
+    parser.add_argument('--response-cache', action='store_true')
+    parser.add_argument('--write-queue', action='store_true', help='group-commit creates and deletes')
+    add_database_args(parser)
+    args = parser.parse_args()
+
+    # request logging would dominate the timings
+    logging.disable(logging.INFO)
+
+    write_results(run(database_url(args), args.questions, args.categories, args.iterations, args.warmup,
+                      args.routes, args.response_cache, args.write_queue), args.output)
+
+
+if __name__ == '__main__':
+    main()
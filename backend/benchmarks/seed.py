@@ -0,0 +1,119 @@
+'''
+Synthetic question bank generator
+
+    python -m benchmarks.seed --questions 1000000 --categories 12 \
+        --database-url postgresql://localhost/trivia_bench
+
+Drops and recreates the tables, then loads the given number of questions
+spread evenly over the categories, in batches (COPY on Postgres). The
+text is built from a fixed vocabulary with a seeded random generator, so
+the same arguments always produce the same data and search terms match a
+realistic share of rows. Schema migrations run after the load, so the
+search indexes are built once over the full table.
+'''
+import argparse
+import io
+import random
+import time
+
+from benchmarks import add_database_args, database_backend, database_url, environment, write_results
+from flaskr import create_app
+from migrations import schema_migrations, upgrade
+from models import db, Question, Category
+
+CATEGORY_NAMES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+
+WORDS = ('which', 'what', 'who', 'where', 'when', 'planet', 'river', 'painter', 'novel', 'team',
+         'country', 'element', 'composer', 'film', 'mountain', 'ocean', 'empire', 'invented',
+         'discovered', 'won', 'wrote', 'largest', 'first', 'oldest', 'famous', 'title', 'world',
+         'cup', 'soccer', 'capital', 'city', 'king', 'queen', 'war', 'century', 'album', 'star')
+
+
+def category_names(count):
+    return [CATEGORY_NAMES[number] if number < len(CATEGORY_NAMES) else 'Category {}'.format(number + 1)
+            for number in range(count)]
+
+
+def generate_questions(total, categories, seed=0):
+    rng = random.Random(seed)
+    for number in range(total):
+        words = rng.sample(WORDS, rng.randint(4, 9))
+        yield {
+            'question': '{} {}?'.format(' '.join(words).capitalize(), number),
+            'answer': '{} {}'.format(rng.choice(WORDS).capitalize(), number),
+            'category': number % categories + 1,
+            'difficulty': rng.randint(1, 5)
+        }
+
+
+def copy_rows(rows):
+    buffer = io.StringIO()
+    for row in rows:
+        # the vocabulary has no tabs, newlines or backslashes to escape
+        buffer.write('{question}\t{answer}\t{category}\t{difficulty}\n'.format(**row))
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert('COPY questions (question, answer, category, difficulty) FROM STDIN', buffer)
+
+
+def insert_rows(rows):
+    if db.engine.dialect.name == 'postgresql':
+        copy_rows(rows)
+    else:
+        db.session.execute(Question.__table__.insert(), rows)
+    db.session.commit()
+
+
+'''
+seed(total, categories=6, batch_size=10000, seed=0)
+    replaces the bound database's data with total synthetic questions and
+    returns the number of seconds the load took
+'''
+
+
+def seed(total, categories=len(CATEGORY_NAMES), batch_size=10000, seed=0):
+    started = time.perf_counter()
+
+    db.drop_all()
+    schema_migrations.drop(db.engine, checkfirst=True)
+    db.create_all()
+    db.session.execute(Category.__table__.insert(), [{'type': name} for name in category_names(categories)])
+    db.session.commit()
+
+    batch = []
+    for row in generate_questions(total, categories, seed):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            insert_rows(batch)
+            batch = []
+    if batch:
+        insert_rows(batch)
+
+    upgrade(db.engine)
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute('ANALYZE questions')
+        db.session.commit()
+
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=len(CATEGORY_NAMES))
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    add_database_args(parser)
+    args = parser.parse_args()
+
+    url = database_url(args)
+    app = create_app({'SQLALCHEMY_DATABASE_URI': url, 'DB_CREATE_ALL': False})
+    with app.app_context():
+        seconds = seed(args.questions, args.categories, args.batch_size, args.seed)
+
+    write_results(environment(database=database_backend(url), questions=args.questions,
+                              categories=args.categories, seed_seconds=round(seconds, 1)), args.output)
+
+
+if __name__ == '__main__':
+    main()
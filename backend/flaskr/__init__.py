@@ -1,43 +1,82 @@
 import os
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, request, abort, stream_with_context
 from flask_cors import CORS
-import random
 import logging
 
-from  sqlalchemy.sql.expression import func
-
-from models import setup_db, Question, Category
-
-QUESTIONS_PER_PAGE = 10
-logging.basicConfig(level=logging.DEBUG)
-
-
-def paginate_questions(request, selection):
-    page = request.args.get('page', 1, type=int)
-    start =  (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
-
-    return current_questions
-
-def get_category_list():
-    # get full list of categories
-    categories = Category.query.order_by(Category.id).all()
-    # declare list for storing categories
-    catlist = {}
-    # loop through categories and append the id and type to the list
-    for cat in categories:
-        catlist[str(cat.id)]=cat.type
-
-    return catlist
+from models import db, setup_db, database_path, notify_change, pool_stats, Question
+from migrations import register_migration_commands, upgrade
+from .config import default_config
+from .pagination import paginate_questions, paginate_questions_after, wants_cursor_page
+from .categories import get_category_list, jsonify_with_categories
+from .encoding import encode_question, encode_questions, json_response, set_json_encoder
+from .metrics import register_metrics, render_metrics
+from .quiz import QUIZ_PREFETCH_MAX, draw_adaptive_question, draw_questions, target_difficulty
+from .sessions import create_session_store, start_session, next_session_questions
+from .errors import error_payload
+from .bulk import MAX_REPORTED_ERRORS, export_questions, import_questions, register_bulk_commands
+from .response_cache import cached_response, create_response_cache, create_single_flight
+from .search import search_questions
+from .stats import question_counts, question_total
+from .snapshot import build_snapshot, register_snapshot_commands
+from .replicas import register_replica_routing, replica_reads
+from .compression import register_compression
+from . import write_queue
+
+
+def wants_full_response(request):
+    # ?full=1 asks a write to return the re-listed page as well as the id
+    return request.args.get('full', '').lower() in ('1', 'true', 'yes')
 
 def create_app(test_config=None):
-    # create and configure the app
+    # create and configure the app - the defaults (each overridable by an
+    # environment variable of the same name), then the settings file named by
+    # TRIVIA_SETTINGS, then test_config. Nothing here touches the database.
     app = Flask(__name__)
-    setup_db(app)
+    app.config.from_mapping(default_config())
+    app.config.from_envvar('TRIVIA_SETTINGS', silent=True)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
+    # logging is left to the server unless LOG_LEVEL is set (DEBUG in development)
+    log_level = app.config['LOG_LEVEL'] or ('DEBUG' if app.env == 'development' else None)
+    if log_level:
+        logging.basicConfig(level=log_level)
+
+    set_json_encoder(app.config['JSON_ENCODER'])
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path))
+    app.extensions['quiz_sessions'] = create_session_store(app.config)
+    app.extensions['response_cache'] = create_response_cache(app.config)
+    app.extensions['single_flight'] = create_single_flight(app.config)
+    if app.config['WRITE_QUEUE']:
+        app.extensions['write_queue'] = write_queue.WriteQueue(app, app.config['WRITE_QUEUE_DELAY'],
+                                                               app.config['WRITE_QUEUE_BATCH'])
+    register_replica_routing(app)
+    if app.config['DB_CREATE_ALL']:
+        # development databases are brought up to date on first use;
+        # production runs 'flask db-upgrade' as a deploy step
+        @app.before_first_request
+        def create_schema():
+            # the primary only - replicas get their schema from it
+            db.create_all(bind=None)
+            try:
+                upgrade(db.engine)
+            except Exception:
+                logging.getLogger(__name__).warning('Unable to apply schema migrations', exc_info=True)
+    # process-wide caches and indexes may hold another database's rows
+    notify_change(None, 'reset')
+    register_bulk_commands(app)
+    register_migration_commands(app)
+    register_snapshot_commands(app)
+    if app.config['SNAPSHOT_PATH']:
+        # with gunicorn --preload this runs once in the master before the fork;
+        # a file left from an earlier run may be missing any number of writes
+        with app.app_context():
+            build_snapshot(app.config['SNAPSHOT_PATH'])
+    if app.config['METRICS_ENABLED']:
+        register_metrics(app)
+    if app.config['COMPRESSION']:
+        # registered after the metrics, so they count the bytes actually sent
+        register_compression(app)
 
     '''
     @TODO: Set up CORS. Allow '*' for origins.
@@ -55,6 +94,35 @@ def create_app(test_config=None):
         response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
         return response
 
+    # HEALTH - database reachability and connection pool utilisation
+
+    @app.route('/health')
+    def health():
+        try:
+            db.session.execute('SELECT 1')
+            database = 'ok'
+        except Exception:
+            db.session.rollback()
+            database = 'unavailable'
+
+        payload = {
+            'success': database == 'ok',
+            'database': database,
+            'pool': pool_stats()
+        }
+        if 'db_replicas' in app.extensions:
+            payload['replicas'] = app.extensions['db_replicas'].stats()
+        return json_response(payload, 200 if database == 'ok' else 503)
+
+    # METRICS - per-route latency, SQL and response size in Prometheus text format
+
+    @app.route('/metrics')
+    def metrics():
+        if 'metrics' not in app.extensions:
+            abort(404)
+
+        return Response(render_metrics(app), mimetype='text/plain; version=0.0.4')
+
     '''
     @TODO:
     Create an endpoint to handle GET requests
@@ -64,18 +132,21 @@ def create_app(test_config=None):
     # GET CATEGORIES
     @app.route('/')
     def index():
-        return jsonify({"test":"name"})
+        return json_response({"test":"name"})
     @app.route('/categories')
+    @replica_reads
+    @cached_response
     def retrieve_categories():
         current_categories = get_category_list()
 
         if not current_categories:
             abort(500)
         else:
-            return jsonify({
+            return jsonify_with_categories({
             'success': True,
-            'categories': current_categories,
-            'total_categories': len(current_categories)
+            'total_categories': len(current_categories),
+            'total_questions': question_total(),
+            'question_counts': question_counts()
             })
 
 
@@ -94,23 +165,42 @@ def create_app(test_config=None):
 
     # GET QUESTIONS (NOT BY CATEGORY)
 
+    # ?after=<cursor>&limit=N - keyset page for crawlers and exports
+    def cursor_page_response(selection, total_questions, current_category=None):
+        try:
+            current_questions, next_cursor = paginate_questions_after(request, selection)
+        except ValueError:
+            abort(400)
+
+        if not current_questions:
+            abort(404)
+        else:
+            return jsonify_with_categories({
+            'success': True,
+            'next_cursor': next_cursor,
+            'total_questions': total_questions,
+            'current_category': current_category or current_questions[0].category
+            }, raw={'questions': encode_questions(current_questions)})
+
     @app.route('/questions')
+    @replica_reads
+    @cached_response
     def retrieve_all_questions():
-        selection = Question.query.order_by(Question.id).all()
+        selection = Question.query.order_by(Question.id)
 
-        current_questions = paginate_questions(request, selection)
-        catlist = get_category_list()
+        if wants_cursor_page(request):
+            return cursor_page_response(selection, question_total(), 'all')
+
+        current_questions, total_questions = paginate_questions(request, selection, question_total())
 
         if not current_questions:
             abort(404)
         else:
-            return jsonify({
+            return jsonify_with_categories({
             'success': True,
-            'questions': current_questions,
-            'total_questions': len(selection),
-            'current_category': 'all',
-            'categories': catlist
-            })
+            'total_questions': total_questions,
+            'current_category': 'all'
+            }, raw={'questions': encode_questions(current_questions)})
 
     '''
     @TODO:
@@ -138,6 +228,7 @@ def create_app(test_config=None):
     # POST QUESTIONS
 
     @app.route('/questions', methods=['POST'])
+    @replica_reads
     def create_search_question():
         new_question = request.json.get('question', None)
         new_answer = request.json.get('answer', None)
@@ -150,38 +241,75 @@ def create_app(test_config=None):
                 abort(400)
             else:
                 # CREATE question functionality
-                question = Question(question=new_question, answer=new_answer, category=new_category, difficulty=new_difficulty)
                 try:
-                    question.insert()
+                    if 'write_queue' in app.extensions:
+                        # committed together with other requests' writes
+                        question = write_queue.queued_write(app, write_queue.insert_question,
+                                                            new_question, new_answer, new_category, new_difficulty)
+                    else:
+                        question = Question(question=new_question, answer=new_answer, category=new_category, difficulty=new_difficulty)
+                        question.insert()
                 except:
                     abort(422)
 
+                if not wants_full_response(request):
+                    return json_response({
+                        'success': True,
+                        'created': question.id,
+                        'total_questions': question_total()
+                    })
+
                 # return question data
-                selection = Question.query.order_by(Question.id).all()
-                current_questions = paginate_questions(request, selection)
+                selection = Question.query.order_by(Question.id)
+                current_questions, total_questions = paginate_questions(request, selection, question_total())
 
                 if not current_questions:
                     abort(404)
                 else:
-                    return jsonify({
+                    return json_response({
                         'success': True,
                         'created': new_question,
-                        'questions': current_questions,
-                        'total_questions': len(Question.query.all())
-                    })
+                        'total_questions': total_questions
+                    }, raw={'questions': encode_questions(current_questions)})
         else:
             # Text search question functionality
-            selection = Question.query.filter(Question.question.ilike('%'+search_term+'%')).all()
-            current_questions = paginate_questions(request, selection)
+            current_questions, total_questions = search_questions(request, search_term)
 
             if not current_questions:
                 abort(404)
             else:
-                return jsonify({
+                return json_response({
                     'success': True,
-                    'questions': current_questions,
-                    'total_questions': len(selection),
-                })
+                    'total_questions': total_questions,
+                }, raw={'questions': encode_questions(current_questions)})
+
+    # BULK IMPORT / EXPORT
+
+    @app.route('/questions/import', methods=['POST'])
+    def import_question_file():
+        # NDJSON by default, CSV (with a header row) when sent as text/csv
+        format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+        batch_size = request.args.get('batch_size', app.config['BULK_BATCH_SIZE'], type=int)
+
+        if batch_size < 1:
+            abort(400)
+
+        lines = (line.decode('utf-8', 'replace') for line in request.stream)
+        imported, errors = import_questions(lines, format, batch_size)
+
+        return json_response({
+            'success': True,
+            'imported': imported,
+            'failed': len(errors),
+            'errors': [{'line': line, 'error': error} for line, error in errors[:MAX_REPORTED_ERRORS]]
+        })
+
+    @app.route('/questions/export')
+    @replica_reads
+    def export_question_file():
+        batch_size = request.args.get('batch_size', app.config['BULK_BATCH_SIZE'], type=int)
+
+        return Response(stream_with_context(export_questions(max(1, batch_size))), mimetype='application/x-ndjson')
 
     '''
     @TODO:
@@ -197,26 +325,40 @@ def create_app(test_config=None):
 
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
     def delete_question(question_id):
-        question = Question.query.filter(Question.id==question_id).one_or_none()
-
-        if question is None:
-            abort(404)
+        if 'write_queue' in app.extensions:
+            try:
+                write_queue.queued_write(app, write_queue.delete_question, question_id)
+            except LookupError:
+                abort(404)
+            except:
+                abort(422)
         else:
-            question.delete()
+            question = Question.query.filter(Question.id==question_id).one_or_none()
+
+            if question is None:
+                abort(404)
+            else:
+                question.delete()
+
+        if not wants_full_response(request):
+            return json_response({
+                'success': True,
+                'deleted': question_id,
+                'total_questions': question_total()
+            })
 
         # return selection for display
-        selection = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, selection)
+        selection = Question.query.order_by(Question.id)
+        current_questions, total_questions = paginate_questions(request, selection, question_total())
 
         if not current_questions:
             abort(404)
         else:
-            return jsonify({
+            return json_response({
                 'success': True,
                 'deleted': question_id,
-                'questions': current_questions,
-                'total_questions': len(Question.query.all())
-            })
+                'total_questions': total_questions
+            }, raw={'questions': encode_questions(current_questions)})
 
     '''
     @TODO:
@@ -231,31 +373,35 @@ def create_app(test_config=None):
     # GET QUESTIONS (BASED ON CATEGORY - OR ALL)
     # Instructions say POST request, but this doesn't make much sense. Front end configured for GET request, so have done this instead
     @app.route('/categories/<int:category_id>/questions')
+    @replica_reads
+    @cached_response
     def retrieve_questions_by_category(category_id):
 
         # use category_id of 0 for all questions
         if category_id == 0:
-            selection = Question.query.order_by(Question.id).all()
+            selection = Question.query.order_by(Question.id)
+            total_questions = question_total()
         else:
             # # Query the categories table to find the id of the category
             # selected_cat = Category.query.filter(Category.type.ilike(category)).one_or_none()
             # selection = Question.query.filter(Question.category==selected_cat.id).order_by(Question.id).all()
 
-            selection = Question.query.filter(Question.category==category_id).order_by(Question.id).all()
+            selection = Question.query.filter(Question.category==category_id).order_by(Question.id)
+            total_questions = question_total(category_id)
+
+        if wants_cursor_page(request):
+            return cursor_page_response(selection, total_questions)
 
-        current_questions = paginate_questions(request, selection)
-        catlist = get_category_list()
+        current_questions, total_questions = paginate_questions(request, selection, total_questions)
 
         if not current_questions:
             abort(404) # TODO - REQUIRE specific error message here
         else:
-            return jsonify({
+            return jsonify_with_categories({
                 'success': True,
-                'questions': current_questions,
-                'total_questions': len(selection),
-                'current_category': selection[0].category,
-                'categories': catlist
-            })
+                'total_questions': total_questions,
+                'current_category': current_questions[0].category
+            }, raw={'questions': encode_questions(current_questions)})
 
     '''
     @TODO:
@@ -269,40 +415,113 @@ def create_app(test_config=None):
     and shown whether they were correct or not. - COMPLETE
     '''
 
+    def prefetch_count(body):
+        # 'count' asks for up to that many questions at once, returned as
+        # 'questions' alongside the usual 'question' (the first of them)
+        count = int(body.get('count', 1))
+        if not 1 <= count <= app.config.get('QUIZ_PREFETCH_MAX', QUIZ_PREFETCH_MAX):
+            raise ValueError(count)
+        return count
+
+    def quiz_response(payload, questions, batched):
+        raw = {'question': encode_question(questions[0])}
+        if batched:
+            raw['questions'] = encode_questions(questions)
+        return json_response(payload, raw=raw)
+
+    # 'adaptive': true serves the next question from a difficulty band picked
+    # from 'difficulty' (the current band) and 'recent_answers' (true/false
+    # for whether each recent answer was correct)
     @app.route('/quizzes', methods=['POST'])
+    @replica_reads
     def play_quiz():
-        error = 422
-
         previous_questions = request.json.get('previous_questions', None)
         quiz_category = request.json.get('quiz_category', None)
+        adaptive = request.json.get('adaptive', False)
 
         try:
             # retrieve category_id from quiz_category dictionary
             category = quiz_category.get('id')
 
-            prevques = []
+            prevques = set()
             for question in previous_questions:
-                prevques.append(question)
+                prevques.add(int(question))
+
+            count = prefetch_count(request.json)
+            if adaptive:
+                # the band for each question depends on the answer before it
+                if count > 1:
+                    raise ValueError(count)
+                difficulty = target_difficulty(int(request.json.get('difficulty', 3)),
+                                               list(request.json.get('recent_answers', [])))
         except:
             abort(400)
 
         try:
-            # frontend sets value of 'ALL' categories to 'click'
-            if category == 0:
-                next_question = Question.query.filter(~Question.id.in_(prevques)).order_by(func.random()).first()
+            # frontend sends 0 for 'ALL' categories - the index keeps a bucket for it
+            if adaptive:
+                next_question, served_difficulty = draw_adaptive_question(int(category), prevques, difficulty)
+                next_questions = [next_question] if next_question else []
             else:
-                next_question = Question.query.filter(Question.category==category).filter(~Question.id.in_(prevques)).order_by(func.random()).first()
+                next_questions = draw_questions(int(category), prevques, count)
+        except:
+            abort(422)
 
-            if not next_question:
-                error = 404
-                abort()
-            else:
-                return jsonify({
-                    'success': True,
-                    'question': next_question.format()
-                })
+        if not next_questions:
+            abort(404)
+        else:
+            payload = {'success': True}
+            if adaptive:
+                payload['difficulty'] = difficulty
+                payload['served_difficulty'] = served_difficulty
+            return quiz_response(payload, next_questions, 'count' in request.json)
+
+    # QUIZ SESSIONS - the server remembers which questions are left, so each
+    # step only sends the session token instead of every previous question
+
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        quiz_category = request.json.get('quiz_category', None)
+
+        try:
+            category = quiz_category.get('id')
         except:
-            abort(error)
+            abort(400)
+
+        try:
+            session, total_questions = start_session(int(category))
+        except:
+            abort(422)
+
+        if not total_questions:
+            abort(404)
+        else:
+            return json_response({
+                'success': True,
+                'session': session,
+                'total_questions': total_questions
+            })
+
+    @app.route('/quizzes/sessions/<session>/next', methods=['POST'])
+    def next_quiz_session_question(session):
+        body = request.get_json(silent=True) or {}
+
+        try:
+            count = prefetch_count(body)
+        except:
+            abort(400)
+
+        try:
+            next_questions = next_session_questions(session, count)
+        except KeyError:
+            abort(404)
+
+        if not next_questions:
+            abort(404)
+        else:
+            return quiz_response({
+                'success': True
+            }, next_questions, 'count' in body)
 
 
     '''
@@ -313,43 +532,23 @@ def create_app(test_config=None):
 
     @app.errorhandler(400)
     def bad_request(error):
-        return jsonify({
-            "success": False,
-            "error": 400,
-            "message": "Unable to process the request due to invalid data. Please reformat the request and resubmit."
-        }), 400
+        return json_response(error_payload(400), 400)
 
     @app.errorhandler(404)
     def not_found(error):
-        return jsonify({
-            "success": False,
-            "error": 404,
-            "message": "The requested resource could not be found."
-        }), 404
+        return json_response(error_payload(404), 404)
 
     @app.errorhandler(405)
     def method_not_allowed(error):
-        return jsonify({
-            "success": False,
-            "error": 405,
-            "message": "Method not allowed - please use an appropriate method with your request, or add a resource."
-        }), 405
+        return json_response(error_payload(405), 405)
 
     @app.errorhandler(422)
     def unprocessable_entity(error):
-        return jsonify({
-            "success": False,
-            "error": 422,
-            "message": "The request was valid, but there was an issue during processing. Data may be out of range. Please consult the documentation and resubmit."
-        }), 422
+        return json_response(error_payload(422), 422)
 
     @app.errorhandler(500)
     def internal_server_error(error):
-        return jsonify({
-            "success": False,
-            "error": 500,
-            "message": "Internal Server Error. We don't quite know what happened here. Please consult the documentation to ensure your request is correctly formatted."
-        }), 500
+        return json_response(error_payload(500), 500)
 
 
 
@@ -0,0 +1,403 @@
+'''
+Async serving mode
+
+create_asgi_app() serves the same routes and JSON contracts as create_app() -
+/categories, /questions (listing, cursor pages, create and search),
+DELETE /questions/<id>, /categories/<id>/questions and /quizzes - on an ASGI
+server, using asyncpg and its connection pool so a request waiting on
+Postgres doesn't hold a worker thread. Postgres only; needs the packages in
+requirements-async.txt.
+
+    uvicorn --workers 4 asgi:app
+'''
+import asyncio
+import contextlib
+import os
+
+import asyncpg
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse as BaseJSONResponse
+from starlette.routing import Route
+
+from models import database_path, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_STATEMENT_TIMEOUT
+from . import encoding
+from .config import default_config
+from .errors import error_payload
+from .pagination import decode_cursor, encode_cursor
+from .quiz import question_index, target_difficulty
+from .search import escape_like, TRIGRAM_CHECK
+from .stats import question_stats
+
+QUESTION_COLUMNS = 'id, question, answer, category, difficulty'
+QUESTION_INDEX_QUERY = 'SELECT id, category, difficulty FROM questions'
+QUESTION_STATS_QUERY = 'SELECT category, difficulty, count(*) FROM questions GROUP BY category, difficulty'
+
+
+class JSONResponse(BaseJSONResponse):
+
+    def render(self, content):
+        # same encoder, and key order, as the Flask app
+        return encoding.dumps(content)
+
+
+def abort(code):
+    raise HTTPException(status_code=code)
+
+
+def get_setting(config, name, default, cast=str):
+    return cast(config.get(name, os.environ.get(name, default)))
+
+
+def int_arg(request, name, default):
+    # like Flask's request.args.get(name, default, type=int)
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def page_size(request, arg='per_page'):
+    config = request.app.state.config
+    size = int_arg(request, arg, config['QUESTIONS_PER_PAGE'])
+    return max(1, min(size, config['MAX_QUESTIONS_PER_PAGE']))
+
+
+def wants_full_response(request):
+    return request.query_params.get('full', '').lower() in ('1', 'true', 'yes')
+
+
+async def read_json(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        abort(400)
+    if not isinstance(body, dict):
+        abort(400)
+    return body
+
+
+async def fetch_categories(connection):
+    rows = await connection.fetch('SELECT id, type FROM categories ORDER BY id')
+    return {str(row['id']): row['type'] for row in rows}
+
+
+'''
+refresh(connection, request, name, cache, ttl, query)
+    reloads cache (question_stats or question_index) from query once it is
+    older than ttl. One coroutine per process runs the query; the others
+    wait for it rather than each reading the whole table. The rows are
+    loaded in the default executor, since building the quiz buckets for a
+    large table would stall every connection on the event loop.
+'''
+
+
+async def refresh(connection, request, name, cache, ttl, query):
+    if not cache.is_fresh(ttl):
+        async with request.app.state.reload_locks[name]:
+            # fresh again if another coroutine reloaded it while this one waited
+            if not cache.is_fresh(ttl):
+                rows = await connection.fetch(query)
+                await asyncio.get_running_loop().run_in_executor(None, cache.load, rows)
+    return cache
+
+
+async def fetch_stats(connection, request):
+    # the maintained question counts shared with the Flask app (flaskr.stats)
+    return await refresh(connection, request, 'stats', question_stats,
+                         request.app.state.config['QUESTION_STATS_TTL'], QUESTION_STATS_QUERY)
+
+
+'''
+fetch_page(connection, request, where, args, order_by, order_args, cursor, total)
+    one page of questions matching the WHERE clause (its parameters numbered
+    from $1, any ORDER BY parameters after them) as (questions, total) for
+    ?page=, or (questions, next_cursor) for ?after=/?limit= when cursor is
+    allowed, mirroring flaskr.pagination. The total is counted unless given.
+'''
+
+
+async def fetch_page(connection, request, where='TRUE', args=(), order_by='id', order_args=(), cursor=True,
+                     total=None):
+    params = request.query_params
+
+    if cursor and ('after' in params or 'limit' in params):
+        try:
+            after_id = decode_cursor(params['after']) if params.get('after') else 0
+        except ValueError:
+            abort(400)
+        limit = page_size(request, 'limit')
+        rows = await connection.fetch(
+            'SELECT {} FROM questions WHERE ({}) AND id > ${} ORDER BY id LIMIT ${}'.format(
+                QUESTION_COLUMNS, where, len(args) + 1, len(args) + 2),
+            *args, after_id, limit + 1)
+        questions = [dict(row) for row in rows[:limit]]
+        return questions, encode_cursor(questions[-1]['id']) if len(rows) > limit else None
+
+    page = int_arg(request, 'page', 1)
+    size = page_size(request)
+    if page < 1:
+        return [], 0
+
+    placeholders = len(args) + len(order_args)
+    rows = await connection.fetch(
+        'SELECT {} FROM questions WHERE {} ORDER BY {} LIMIT ${} OFFSET ${}'.format(
+            QUESTION_COLUMNS, where, order_by, placeholders + 1, placeholders + 2),
+        *args, *order_args, size, (page - 1) * size)
+    if not rows:
+        return [], 0
+
+    if total is None:
+        total = await connection.fetchval('SELECT count(*) FROM questions WHERE {}'.format(where), *args)
+    return [dict(row) for row in rows], total
+
+
+def page_response(questions, extra, total, current_category):
+    if not questions:
+        abort(404)
+    payload = {'success': True, 'questions': questions, 'total_questions': total,
+               'current_category': current_category}
+    if not isinstance(extra, int):
+        payload['next_cursor'] = extra
+    return payload
+
+
+async def retrieve_categories(request):
+    async with request.app.state.pool.acquire() as connection:
+        categories = await fetch_categories(connection)
+        stats = await fetch_stats(connection, request)
+
+    if not categories:
+        abort(500)
+    return JSONResponse({
+        'success': True,
+        'categories': categories,
+        'total_categories': len(categories),
+        'total_questions': stats.total(),
+        'question_counts': stats.by_category()
+    })
+
+
+async def retrieve_all_questions(request):
+    async with request.app.state.pool.acquire() as connection:
+        total = (await fetch_stats(connection, request)).total()
+        questions, extra = await fetch_page(connection, request, total=total)
+        payload = page_response(questions, extra, total, 'all')
+        payload['categories'] = await fetch_categories(connection)
+
+    return JSONResponse(payload)
+
+
+async def retrieve_questions_by_category(request):
+    category_id = request.path_params['category_id']
+
+    async with request.app.state.pool.acquire() as connection:
+        stats = await fetch_stats(connection, request)
+        if category_id == 0:
+            total = stats.total()
+            questions, extra = await fetch_page(connection, request, total=total)
+        else:
+            total = stats.total(category_id)
+            questions, extra = await fetch_page(connection, request, 'category = $1', (category_id,), total=total)
+        payload = page_response(questions, extra, total, questions[0]['category'] if questions else None)
+        payload['categories'] = await fetch_categories(connection)
+
+    return JSONResponse(payload)
+
+
+async def create_search_question(request):
+    body = await read_json(request)
+    search_term = body.get('searchTerm', None)
+    config = request.app.state.config
+
+    async with request.app.state.pool.acquire() as connection:
+        if search_term is not None:
+            pattern = '%' + escape_like(str(search_term)) + '%'
+            where = "question ILIKE $1 ESCAPE '\\'"
+            if config['SEARCH_INCLUDE_ANSWERS']:
+                where = "({} OR answer ILIKE $1 ESCAPE '\\')".format(where)
+            if request.app.state.trigram_search and config['SEARCH_BACKEND'] in ('auto', 'postgres'):
+                order_by, order_args = 'word_similarity($2, question) DESC, id', (str(search_term),)
+            else:
+                # no pg_trgm (or SEARCH_BACKEND=ilike) - plain ILIKE in id order
+                order_by, order_args = 'id', ()
+            questions, total = await fetch_page(connection, request, where, (pattern,), order_by, order_args,
+                                                cursor=False)
+            if not questions:
+                abort(404)
+            return JSONResponse({'success': True, 'questions': questions, 'total_questions': total})
+
+        values = [body.get(field) for field in ('question', 'answer', 'category', 'difficulty')]
+        if any(value is None for value in values):
+            abort(400)
+
+        stats = await fetch_stats(connection, request)
+        try:
+            created = await connection.fetchrow(
+                'INSERT INTO questions (question, answer, category, difficulty) '
+                'VALUES ($1, $2, $3::text::integer, $4::text::integer) RETURNING id, category, difficulty',
+                str(values[0]), str(values[1]), str(values[2]), str(values[3]))
+        except (asyncpg.PostgresError, ValueError):
+            abort(422)
+        question_id = created['id']
+        question_index.add(question_id, created['category'], created['difficulty'])
+        stats.add(created['category'], created['difficulty'], 1)
+
+        if not wants_full_response(request):
+            return JSONResponse({
+                'success': True,
+                'created': question_id,
+                'total_questions': stats.total()
+            })
+
+        questions, total = await fetch_page(connection, request, total=stats.total())
+        if not questions:
+            abort(404)
+        return JSONResponse({'success': True, 'created': values[0], 'questions': questions, 'total_questions': total})
+
+
+async def delete_question(request):
+    question_id = request.path_params['question_id']
+
+    async with request.app.state.pool.acquire() as connection:
+        stats = await fetch_stats(connection, request)
+        deleted = await connection.fetchrow(
+            'DELETE FROM questions WHERE id = $1 RETURNING category, difficulty', question_id)
+        if deleted is None:
+            abort(404)
+        question_index.remove(question_id)
+        stats.add(deleted['category'], deleted['difficulty'], -1)
+
+        if not wants_full_response(request):
+            return JSONResponse({
+                'success': True,
+                'deleted': question_id,
+                'total_questions': stats.total()
+            })
+
+        questions, total = await fetch_page(connection, request, total=stats.total())
+        if not questions:
+            abort(404)
+        return JSONResponse({'success': True, 'deleted': question_id, 'questions': questions, 'total_questions': total})
+
+
+async def play_quiz(request):
+    body = await read_json(request)
+
+    adaptive = body.get('adaptive', False)
+
+    try:
+        category = body.get('quiz_category', None).get('id')
+        prevques = set(int(question) for question in body.get('previous_questions', None))
+        count = int(body.get('count', 1))
+        if not 1 <= count <= request.app.state.config['QUIZ_PREFETCH_MAX'] or (adaptive and count > 1):
+            abort(400)
+        if adaptive:
+            difficulty = target_difficulty(int(body.get('difficulty', 3)), list(body.get('recent_answers', [])))
+    except (AttributeError, TypeError, ValueError):
+        abort(400)
+
+    try:
+        category = int(category)
+    except (TypeError, ValueError):
+        abort(422)
+
+    async with request.app.state.pool.acquire() as connection:
+        await refresh(connection, request, 'quiz', question_index,
+                      request.app.state.config['QUIZ_INDEX_TTL'], QUESTION_INDEX_QUERY)
+
+        questions = []
+        while len(questions) < count:
+            if adaptive:
+                question_id, band = question_index.sample_band(category, difficulty, prevques)
+                question_ids = [question_id] if question_id is not None else []
+            else:
+                question_ids = question_index.sample_many(category, prevques, count - len(questions))
+            if not question_ids:
+                break
+
+            rows = {row['id']: dict(row) for row in await connection.fetch(
+                'SELECT {} FROM questions WHERE id = ANY($1::integer[])'.format(QUESTION_COLUMNS), question_ids)}
+            for question_id in question_ids:
+                if question_id in rows:
+                    questions.append(rows[question_id])
+                else:
+                    question_index.remove(question_id)
+            prevques.update(question_ids)
+
+    if not questions:
+        abort(404)
+    payload = {'success': True, 'question': questions[0]}
+    if 'count' in body:
+        payload['questions'] = questions
+    if adaptive:
+        payload['difficulty'] = difficulty
+        payload['served_difficulty'] = band
+    return JSONResponse(payload)
+
+
+async def http_error(request, exc):
+    code = exc.status_code if exc.status_code in (400, 404, 405, 422) else 500
+    return JSONResponse(error_payload(code), status_code=code)
+
+
+async def server_error(request, exc):
+    return JSONResponse(error_payload(500), status_code=500)
+
+
+def create_asgi_app(test_config=None):
+    config = default_config()
+    config['SQLALCHEMY_DATABASE_URI'] = database_path
+    if test_config is not None:
+        config.update(test_config)
+    encoding.set_json_encoder(config['JSON_ENCODER'])
+
+    # asyncpg wants a plain postgresql:// DSN
+    dsn = config['SQLALCHEMY_DATABASE_URI'].replace('postgresql+psycopg2://', 'postgresql://', 1)
+    statement_timeout = get_setting(config, 'DB_STATEMENT_TIMEOUT', DB_STATEMENT_TIMEOUT, int)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        app.state.pool = await asyncpg.create_pool(
+            dsn,
+            min_size=1,
+            max_size=get_setting(config, 'DB_POOL_SIZE', DB_POOL_SIZE, int)
+            + get_setting(config, 'DB_MAX_OVERFLOW', DB_MAX_OVERFLOW, int),
+            timeout=get_setting(config, 'DB_POOL_TIMEOUT', DB_POOL_TIMEOUT, float),
+            server_settings={'statement_timeout': str(statement_timeout)} if statement_timeout else None
+        )
+        # created here, on the server's event loop
+        app.state.reload_locks = {'stats': asyncio.Lock(), 'quiz': asyncio.Lock()}
+        async with app.state.pool.acquire() as connection:
+            app.state.trigram_search = await connection.fetchval(TRIGRAM_CHECK)
+        try:
+            yield
+        finally:
+            await app.state.pool.close()
+
+    middleware = [
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['GET', 'PUT', 'POST', 'DELETE', 'OPTIONS'],
+                   allow_headers=['Content-Type', 'Authorization'])
+    ]
+    if config['COMPRESSION']:
+        # gzip only, compressed per response
+        middleware.append(Middleware(GZipMiddleware, minimum_size=config['COMPRESS_MIN_SIZE']))
+
+    app = Starlette(
+        routes=[
+            Route('/categories', retrieve_categories, methods=['GET']),
+            Route('/questions', retrieve_all_questions, methods=['GET']),
+            Route('/questions', create_search_question, methods=['POST']),
+            Route('/questions/{question_id:int}', delete_question, methods=['DELETE']),
+            Route('/categories/{category_id:int}/questions', retrieve_questions_by_category, methods=['GET']),
+            Route('/quizzes', play_quiz, methods=['POST']),
+        ],
+        middleware=middleware,
+        exception_handlers={HTTPException: http_error, Exception: server_error},
+        lifespan=lifespan
+    )
+    app.state.config = config
+    return app
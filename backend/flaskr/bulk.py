@@ -0,0 +1,192 @@
+import csv
+import io
+import sys
+
+import click
+from flask import current_app, json
+
+from models import db, notify_change, Question
+from .categories import get_category_list
+from .snapshot import build_snapshot
+
+BULK_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+QUESTION_COLUMNS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+
+'''
+validate_row(row, categories)
+    checks one imported record and returns the values to insert, or raises
+    ValueError with a message for the import report
+'''
+
+
+def validate_row(row, categories):
+    if not isinstance(row, dict):
+        raise ValueError('expected an object with question, answer, category and difficulty')
+
+    values = {}
+    for field in ('question', 'answer'):
+        text = row.get(field)
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError('{} is required'.format(field))
+        values[field] = text.strip()
+
+    try:
+        values['category'] = int(row.get('category'))
+        values['difficulty'] = int(row.get('difficulty'))
+    except (TypeError, ValueError):
+        raise ValueError('category and difficulty must be integers')
+
+    if str(values['category']) not in categories:
+        raise ValueError('unknown category {}'.format(values['category']))
+    if not 1 <= values['difficulty'] <= 5:
+        raise ValueError('difficulty must be between 1 and 5')
+
+    return values
+
+
+def read_records(lines, format):
+    # yields (line number, record or ValueError) without holding the input
+    if format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, ValueError('invalid JSON')
+
+
+def copy_batch(batch):
+    # Postgres COPY of the validated rows through the session's connection
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in batch:
+        writer.writerow([values['question'], values['answer'], values['category'], values['difficulty']])
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert('COPY questions (question, answer, category, difficulty) FROM STDIN WITH CSV', buffer)
+
+
+def insert_batch(batch, line_numbers, errors):
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            copy_batch(batch)
+        else:
+            db.session.bulk_insert_mappings(Question, batch)
+        db.session.commit()
+        return len(batch)
+    except Exception:
+        db.session.rollback()
+
+    # the batch was refused as a whole - retry row by row to find the culprits
+    inserted = 0
+    for line_number, values in zip(line_numbers, batch):
+        try:
+            db.session.bulk_insert_mappings(Question, [values])
+            db.session.commit()
+            inserted += 1
+        except Exception as error:
+            db.session.rollback()
+            errors.append((line_number, str(getattr(error, 'orig', error))))
+    return inserted
+
+
+'''
+import_questions(lines, format='ndjson', batch_size=BULK_BATCH_SIZE)
+    streams NDJSON or CSV lines into the questions table, committing every
+    batch_size valid rows (COPY on Postgres, bulk inserts elsewhere). Invalid
+    rows are reported and skipped without aborting their batch. Returns
+    (rows imported, [(line number, error)]).
+'''
+
+
+def import_questions(lines, format='ndjson', batch_size=BULK_BATCH_SIZE):
+    categories = get_category_list()
+    imported = 0
+    errors = []
+    batch, line_numbers = [], []
+
+    for line_number, record in read_records(lines, format):
+        try:
+            if isinstance(record, ValueError):
+                raise record
+            batch.append(validate_row(record, categories))
+            line_numbers.append(line_number)
+        except ValueError as error:
+            errors.append((line_number, str(error)))
+
+        if len(batch) >= batch_size:
+            imported += insert_batch(batch, line_numbers, errors)
+            batch, line_numbers = [], []
+
+    if batch:
+        imported += insert_batch(batch, line_numbers, errors)
+
+    if imported:
+        # bulk rows skip Question.insert(), so in-process indexes start over
+        notify_change(None, 'reset')
+
+    return imported, errors
+
+
+'''
+export_questions(batch_size=BULK_BATCH_SIZE)
+    yields every question as an NDJSON line, read through a server-side
+    cursor (stream_results) so the table is never held in memory
+'''
+
+
+def export_questions(batch_size=BULK_BATCH_SIZE):
+    columns = [getattr(Question, column) for column in QUESTION_COLUMNS]
+    selection = db.session.query(*columns).order_by(Question.id) \
+        .execution_options(stream_results=True).yield_per(batch_size)
+
+    for row in selection:
+        yield json.dumps(dict(zip(QUESTION_COLUMNS, row))) + '\n'
+
+
+def register_bulk_commands(app):
+
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'format', type=click.Choice(['ndjson', 'csv']), default=None,
+                  help='Input format, taken from the file extension by default.')
+    @click.option('--batch-size', type=int, default=None, help='Rows per transaction.')
+    def import_questions_command(path, format, batch_size):
+        '''Import questions from an NDJSON or CSV file.'''
+        format = format or ('csv' if path.endswith('.csv') else 'ndjson')
+        batch_size = batch_size or current_app.config.get('BULK_BATCH_SIZE', BULK_BATCH_SIZE)
+
+        with open(path, newline='', encoding='utf-8') as lines:
+            imported, errors = import_questions(lines, format, batch_size)
+
+        for line_number, error in errors:
+            click.echo('line {}: {}'.format(line_number, error), err=True)
+        click.echo('Imported {} questions, {} rejected'.format(imported, len(errors)))
+
+        # the rebuild the import scheduled would not outlive this process
+        path = current_app.config.get('SNAPSHOT_PATH')
+        if path and imported:
+            click.echo('Published snapshot version {} to {}'.format(build_snapshot(path), path))
+
+    @app.cli.command('export-questions')
+    @click.argument('path', type=click.Path(dir_okay=False, writable=True), required=False)
+    def export_questions_command(path):
+        '''Export every question as NDJSON to PATH or stdout.'''
+        batch_size = current_app.config.get('BULK_BATCH_SIZE', BULK_BATCH_SIZE)
+        output = open(path, 'w', encoding='utf-8') if path else sys.stdout
+        try:
+            for line in export_questions(batch_size):
+                output.write(line)
+        finally:
+            if path:
+                output.close()
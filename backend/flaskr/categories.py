@@ -0,0 +1,103 @@
+import threading
+import time
+
+from flask import current_app
+
+from models import Category, on_change
+from . import encoding
+from .snapshot import current_snapshot
+
+CATEGORY_CACHE_TTL = 300
+
+
+'''
+CategoryCache
+    process-wide cache of the category map and its pre-serialized JSON.
+    Entries live for at most CATEGORY_CACHE_TTL seconds and are dropped as soon
+    as a category is written in this process. The version counter stops a load
+    that raced with an invalidation from storing stale data.
+'''
+
+
+class CategoryCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.loaded_at = 0
+        self.categories = None
+        self.fragment = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ttl):
+        with self.lock:
+            if self.categories is not None and time.monotonic() - self.loaded_at < ttl:
+                self.hits += 1
+                return self.categories, self.fragment
+            self.misses += 1
+            version = self.version
+
+        categories = {}
+        for cat in Category.query.order_by(Category.id).all():
+            categories[str(cat.id)] = cat.type
+        fragment = encoding.dumps(categories)
+
+        with self.lock:
+            if self.version == version:
+                self.categories = categories
+                self.fragment = fragment
+                self.loaded_at = time.monotonic()
+
+        return categories, fragment
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.categories = None
+            self.fragment = None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'version': self.version
+        }
+
+
+category_cache = CategoryCache()
+
+
+@on_change
+def invalidate_category_cache(instance, action):
+    if action == 'reset' or isinstance(instance, Category):
+        category_cache.invalidate()
+
+
+def get_categories():
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        return snapshot.categories, snapshot.fragment
+    return category_cache.get(current_app.config.get('CATEGORY_CACHE_TTL', CATEGORY_CACHE_TTL))
+
+
+'''
+get_category_list()
+    {'<id>': type} for every category - shared, so callers must not modify it
+'''
+
+
+def get_category_list():
+    return get_categories()[0]
+
+
+'''
+jsonify_with_categories(payload, status=200, raw=None)
+    json_response(payload) with a 'categories' key, splicing in the cached
+    JSON fragment instead of re-serializing the category map every request
+'''
+
+
+def jsonify_with_categories(payload, status=200, raw=None):
+    raw = dict(raw or {}, categories=get_categories()[1])
+    return encoding.json_response(payload, status, raw)
@@ -0,0 +1,134 @@
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION = True
+COMPRESS_MIN_SIZE = 500
+COMPRESS_CACHE_SIZE = 256
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'text/csv')
+
+
+def gzip_compress(body):
+    # mtime=0 keeps the output, and so its ETag, identical across workers
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def brotli_compress(body):
+    return brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+# best first - brotli only when the optional package is installed
+compressors = OrderedDict([('gzip', gzip_compress)])
+if brotli is not None:
+    compressors['br'] = brotli_compress
+    compressors.move_to_end('br', last=False)
+
+
+def choose_encoding(accept_encodings):
+    return accept_encodings.best_match(list(compressors)) if accept_encodings else None
+
+
+def encoded_etag(etag, encoding):
+    # a compressed body is a different representation, so it gets its own
+    # strong ETag
+    return '{}-{}'.format(etag, encoding)
+
+
+'''
+etag_matches(if_none_match, etag)
+    whether If-None-Match names the entity tag of the plain body or of one of
+    its compressed forms
+'''
+
+
+def etag_matches(if_none_match, etag):
+    return any(if_none_match.contains(tag)
+               for tag in [etag] + [encoded_etag(etag, encoding) for encoding in compressors])
+
+
+'''
+CompressedBodies
+    LRU of compressed response bodies keyed by (ETag, encoding). cached_response
+    ETags are a hash of the body for one data version, so a hot page is
+    compressed once per version and encoding, and entries for older versions
+    simply age out.
+'''
+
+
+class CompressedBodies:
+
+    def __init__(self, max_entries=COMPRESS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, compress, body):
+        with self.lock:
+            compressed = self.entries.get(key)
+            if compressed is not None:
+                self.entries.move_to_end(key)
+                return compressed
+
+        compressed = compress(body)
+        with self.lock:
+            self.entries[key] = compressed
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return compressed
+
+
+'''
+register_compression(app)
+    gzip or brotli, as the client's Accept-Encoding prefers, for responses
+    of at least COMPRESS_MIN_SIZE bytes. Bodies with an ETag (the cached read
+    views) come from a CompressedBodies cache; others are compressed per
+    request. Streamed responses (the export) are sent as they are.
+'''
+
+
+def register_compression(app):
+    min_size = app.config.get('COMPRESS_MIN_SIZE', COMPRESS_MIN_SIZE)
+    bodies = app.extensions['compressed_bodies'] = CompressedBodies(
+        app.config.get('COMPRESS_CACHE_SIZE', COMPRESS_CACHE_SIZE))
+
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or response.is_streamed \
+                or response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return response
+
+        encoding = choose_encoding(request.accept_encodings)
+        etag, weak = response.get_etag()
+
+        if response.status_code == 304:
+            # answer with the tag the client holds
+            if encoding and etag and request.if_none_match.contains(encoded_etag(etag, encoding)):
+                response.set_etag(encoded_etag(etag, encoding), weak)
+            response.vary.add('Accept-Encoding')
+            return response
+
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        response.vary.add('Accept-Encoding')
+        if not encoding:
+            return response
+
+        compress = compressors[encoding]
+        if etag:
+            response.set_data(bodies.get((etag, encoding), compress, body))
+            response.set_etag(encoded_etag(etag, encoding), weak)
+        else:
+            response.set_data(compress(body))
+        response.headers['Content-Encoding'] = encoding
+        return response
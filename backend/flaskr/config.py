@@ -0,0 +1,64 @@
+import os
+
+from .pagination import QUESTIONS_PER_PAGE, MAX_QUESTIONS_PER_PAGE
+from .categories import CATEGORY_CACHE_TTL
+from .quiz import QUIZ_INDEX_TTL, QUIZ_PREFETCH_MAX
+from .sessions import QUIZ_SESSION_STORE, QUIZ_SESSION_TTL, QUIZ_SESSION_MAX, QUIZ_SESSION_LENGTH
+from .bulk import BULK_BATCH_SIZE
+from .response_cache import (RESPONSE_CACHE, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_LOCAL_TTL,
+                             REQUEST_COALESCING, REQUEST_COALESCING_TIMEOUT)
+from .search import SEARCH_BACKEND, SEARCH_INCLUDE_ANSWERS, SEARCH_INDEX_TTL
+from .encoding import JSON_ENCODER, QUESTION_JSON_CACHE_SIZE, QUESTION_JSON_CACHE_TTL
+from .metrics import METRICS_ENABLED, SLOW_REQUEST_SECONDS
+from .stats import QUESTION_STATS_TTL
+from .snapshot import SNAPSHOT_PATH, SNAPSHOT_CHECK_SECONDS, SNAPSHOT_MAX_AGE, SNAPSHOT_REBUILD_DELAY
+from .compression import COMPRESSION, COMPRESS_MIN_SIZE, COMPRESS_CACHE_SIZE
+from .write_queue import WRITE_QUEUE, WRITE_QUEUE_DELAY, WRITE_QUEUE_BATCH
+
+
+'''
+default_config()
+    settings shared by the Flask and ASGI apps, each of which can be
+    overridden by an environment variable of the same name
+'''
+
+
+def default_config():
+    return dict(
+        LOG_LEVEL=os.environ.get('LOG_LEVEL', ''),
+        QUESTIONS_PER_PAGE=int(os.environ.get('QUESTIONS_PER_PAGE', QUESTIONS_PER_PAGE)),
+        MAX_QUESTIONS_PER_PAGE=int(os.environ.get('MAX_QUESTIONS_PER_PAGE', MAX_QUESTIONS_PER_PAGE)),
+        CATEGORY_CACHE_TTL=float(os.environ.get('CATEGORY_CACHE_TTL', CATEGORY_CACHE_TTL)),
+        QUIZ_INDEX_TTL=float(os.environ.get('QUIZ_INDEX_TTL', QUIZ_INDEX_TTL)),
+        QUIZ_PREFETCH_MAX=int(os.environ.get('QUIZ_PREFETCH_MAX', QUIZ_PREFETCH_MAX)),
+        QUIZ_SESSION_STORE=os.environ.get('QUIZ_SESSION_STORE', QUIZ_SESSION_STORE),
+        QUIZ_SESSION_TTL=int(os.environ.get('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL)),
+        QUIZ_SESSION_MAX=int(os.environ.get('QUIZ_SESSION_MAX', QUIZ_SESSION_MAX)),
+        QUIZ_SESSION_LENGTH=int(os.environ.get('QUIZ_SESSION_LENGTH', QUIZ_SESSION_LENGTH)),
+        SEARCH_BACKEND=os.environ.get('SEARCH_BACKEND', SEARCH_BACKEND),
+        SEARCH_INCLUDE_ANSWERS=os.environ.get('SEARCH_INCLUDE_ANSWERS', str(SEARCH_INCLUDE_ANSWERS)).lower() == 'true',
+        SEARCH_INDEX_TTL=float(os.environ.get('SEARCH_INDEX_TTL', SEARCH_INDEX_TTL)),
+        BULK_BATCH_SIZE=int(os.environ.get('BULK_BATCH_SIZE', BULK_BATCH_SIZE)),
+        RESPONSE_CACHE=os.environ.get('RESPONSE_CACHE', RESPONSE_CACHE),
+        RESPONSE_CACHE_SIZE=int(os.environ.get('RESPONSE_CACHE_SIZE', RESPONSE_CACHE_SIZE)),
+        RESPONSE_CACHE_TTL=float(os.environ.get('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL)),
+        RESPONSE_CACHE_LOCAL_TTL=float(os.environ.get('RESPONSE_CACHE_LOCAL_TTL', RESPONSE_CACHE_LOCAL_TTL)),
+        REQUEST_COALESCING=os.environ.get('REQUEST_COALESCING', REQUEST_COALESCING),
+        REQUEST_COALESCING_TIMEOUT=float(os.environ.get('REQUEST_COALESCING_TIMEOUT', REQUEST_COALESCING_TIMEOUT)),
+        JSON_ENCODER=os.environ.get('JSON_ENCODER', JSON_ENCODER),
+        QUESTION_JSON_CACHE_SIZE=int(os.environ.get('QUESTION_JSON_CACHE_SIZE', QUESTION_JSON_CACHE_SIZE)),
+        QUESTION_JSON_CACHE_TTL=float(os.environ.get('QUESTION_JSON_CACHE_TTL', QUESTION_JSON_CACHE_TTL)),
+        METRICS_ENABLED=os.environ.get('METRICS_ENABLED', str(METRICS_ENABLED)).lower() == 'true',
+        SLOW_REQUEST_SECONDS=float(os.environ.get('SLOW_REQUEST_SECONDS', SLOW_REQUEST_SECONDS)),
+        QUESTION_STATS_TTL=float(os.environ.get('QUESTION_STATS_TTL', QUESTION_STATS_TTL)),
+        SNAPSHOT_PATH=os.environ.get('SNAPSHOT_PATH', SNAPSHOT_PATH),
+        SNAPSHOT_CHECK_SECONDS=float(os.environ.get('SNAPSHOT_CHECK_SECONDS', SNAPSHOT_CHECK_SECONDS)),
+        SNAPSHOT_REBUILD_DELAY=float(os.environ.get('SNAPSHOT_REBUILD_DELAY', SNAPSHOT_REBUILD_DELAY)),
+        SNAPSHOT_MAX_AGE=float(os.environ.get('SNAPSHOT_MAX_AGE', SNAPSHOT_MAX_AGE)),
+        COMPRESSION=os.environ.get('COMPRESSION', str(COMPRESSION)).lower() == 'true',
+        COMPRESS_MIN_SIZE=int(os.environ.get('COMPRESS_MIN_SIZE', COMPRESS_MIN_SIZE)),
+        COMPRESS_CACHE_SIZE=int(os.environ.get('COMPRESS_CACHE_SIZE', COMPRESS_CACHE_SIZE)),
+        WRITE_QUEUE=os.environ.get('WRITE_QUEUE', str(WRITE_QUEUE)).lower() == 'true',
+        WRITE_QUEUE_DELAY=float(os.environ.get('WRITE_QUEUE_DELAY', WRITE_QUEUE_DELAY)),
+        WRITE_QUEUE_BATCH=int(os.environ.get('WRITE_QUEUE_BATCH', WRITE_QUEUE_BATCH)),
+    )
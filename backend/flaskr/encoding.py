@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+
+from flask import current_app
+
+from models import on_change, Category
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_ENCODER = 'auto'
+QUESTION_JSON_CACHE_SIZE = 10000
+QUESTION_JSON_CACHE_TTL = 60
+
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def orjson_dumps(obj):
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+
+encoders = {'json': stdlib_dumps}
+if orjson is not None:
+    encoders['orjson'] = orjson_dumps
+
+dumps = orjson_dumps if orjson is not None else stdlib_dumps
+
+
+'''
+set_json_encoder(name)
+    picks the encoder behind dumps() - 'orjson', 'json', or 'auto' for orjson
+    when it is installed. Both sort keys like jsonify, so responses only
+    differ in whitespace.
+'''
+
+
+def set_json_encoder(name):
+    global dumps
+
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in encoders else 'json'
+    if name not in encoders:
+        raise ValueError('Unknown JSON_ENCODER: {}'.format(name))
+    dumps = encoders[name]
+
+
+def encode_object(payload, raw=None):
+    if not raw:
+        return dumps(payload)
+
+    members = []
+    for key in sorted(list(payload) + list(raw)):
+        value = raw[key] if key in raw else dumps(payload[key])
+        members.append(dumps(key) + b':' + value)
+    return b'{' + b','.join(members) + b'}'
+
+
+'''
+json_response(payload, status=200, raw=None)
+    like jsonify(payload) using the configured encoder. raw maps extra keys to
+    values that are already JSON bytes (category maps, question lists), which
+    are spliced in as they are instead of being decoded and re-encoded.
+'''
+
+
+def json_response(payload, status=200, raw=None):
+    return current_app.response_class(
+        encode_object(payload, raw) + b'\n',
+        status=status,
+        mimetype=current_app.config['JSONIFY_MIMETYPE']
+    )
+
+
+'''
+QuestionJSONCache
+    pre-encoded JSON of question.format() by question id, so list responses
+    are assembled by joining bytes. Entries are dropped when the question is
+    updated or deleted in this process and expire after ttl seconds to pick
+    up writes from other workers.
+'''
+
+
+class QuestionJSONCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def encode(self, question, max_entries, ttl):
+        now = time.monotonic()
+        entry = self.entries.get(question.id)
+        if entry is not None and now - entry[0] < ttl:
+            return entry[1]
+
+        encoded = dumps(question.format())
+        if max_entries > 0:
+            with self.lock:
+                if len(self.entries) >= max_entries:
+                    # dicts keep insertion order - drop the oldest entry
+                    self.entries.pop(next(iter(self.entries)), None)
+                self.entries[question.id] = (now, encoded)
+        return encoded
+
+    def discard(self, question_id):
+        with self.lock:
+            self.entries.pop(question_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+question_json = QuestionJSONCache()
+
+
+@on_change
+def invalidate_question_json(instance, action):
+    # a category delete nulls its questions' category through the foreign key
+    if action == 'reset' or isinstance(instance, Category):
+        question_json.clear()
+    elif action in ('update', 'delete'):
+        question_json.discard(instance.id)
+
+
+def encode_question(question):
+    return question_json.encode(
+        question,
+        current_app.config.get('QUESTION_JSON_CACHE_SIZE', QUESTION_JSON_CACHE_SIZE),
+        current_app.config.get('QUESTION_JSON_CACHE_TTL', QUESTION_JSON_CACHE_TTL)
+    )
+
+
+def encode_questions(questions):
+    max_entries = current_app.config.get('QUESTION_JSON_CACHE_SIZE', QUESTION_JSON_CACHE_SIZE)
+    ttl = current_app.config.get('QUESTION_JSON_CACHE_TTL', QUESTION_JSON_CACHE_TTL)
+
+    return b'[' + b','.join(question_json.encode(question, max_entries, ttl) for question in questions) + b']'
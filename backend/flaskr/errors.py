@@ -0,0 +1,19 @@
+'''
+Error responses shared by the Flask app and the ASGI app
+'''
+
+ERROR_MESSAGES = {
+    400: "Unable to process the request due to invalid data. Please reformat the request and resubmit.",
+    404: "The requested resource could not be found.",
+    405: "Method not allowed - please use an appropriate method with your request, or add a resource.",
+    422: "The request was valid, but there was an issue during processing. Data may be out of range. Please consult the documentation and resubmit.",
+    500: "Internal Server Error. We don't quite know what happened here. Please consult the documentation to ensure your request is correctly formatted."
+}
+
+
+def error_payload(code):
+    return {
+        "success": False,
+        "error": code,
+        "message": ERROR_MESSAGES[code]
+    }
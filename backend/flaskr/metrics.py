@@ -0,0 +1,229 @@
+import bisect
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import pool_stats
+from .categories import category_cache
+
+METRICS_ENABLED = True
+SLOW_REQUEST_SECONDS = 0
+MAX_LOGGED_STATEMENTS = 50
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+logger = logging.getLogger(__name__)
+
+
+'''
+Histogram
+    cumulative-on-render histogram with fixed upper bounds, as Prometheus
+    expects - observe() only bumps one bucket
+'''
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative))
+        lines.append('{}_sum{{{}}} {}'.format(name, labels, round(self.sum, 6)))
+        lines.append('{}_count{{{}}} {}'.format(name, labels, self.count))
+        return lines
+
+
+'''
+RequestStats
+    what one request did - collected in flask.g by the SQLAlchemy cursor
+    events while the request runs
+'''
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'sql_seconds', 'rows', 'statements')
+
+    def __init__(self, capture_statements):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.statements = [] if capture_statements else None
+
+
+'''
+MetricsRegistry
+    per-route request counts, latency and SQL-per-request histograms, SQL
+    time, rows loaded and response bytes for this process. Each worker keeps
+    its own, so scrape every worker (or sum them) for a whole deployment.
+'''
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.query_counts = {}
+        self.totals = {}
+
+    def record(self, method, route, status, stats, seconds, response_bytes):
+        key = (method, route)
+        with self.lock:
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.query_counts[key] = Histogram(QUERY_COUNT_BUCKETS)
+                self.totals[key] = [0.0, 0, 0]
+            self.latency[key].observe(seconds)
+            self.query_counts[key].observe(stats.queries)
+            totals = self.totals[key]
+            totals[0] += stats.sql_seconds
+            totals[1] += stats.rows
+            totals[2] += response_bytes
+
+    def render(self):
+        lines = []
+        with self.lock:
+            lines += ['# HELP trivia_requests_total Requests served.', '# TYPE trivia_requests_total counter']
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append('trivia_requests_total{{{},status="{}"}} {}'.format(
+                    route_labels(method, route), status, count))
+
+            lines += ['# HELP trivia_request_duration_seconds Request latency.',
+                      '# TYPE trivia_request_duration_seconds histogram']
+            for key, histogram in sorted(self.latency.items()):
+                lines += histogram.render('trivia_request_duration_seconds', route_labels(*key))
+
+            lines += ['# HELP trivia_request_sql_queries SQL statements run per request.',
+                      '# TYPE trivia_request_sql_queries histogram']
+            for key, histogram in sorted(self.query_counts.items()):
+                lines += histogram.render('trivia_request_sql_queries', route_labels(*key))
+
+            for index, (name, help) in enumerate((
+                    ('trivia_request_sql_seconds_total', 'Time spent running SQL.'),
+                    ('trivia_request_rows_total', 'Rows returned by SELECTs, where the driver reports them.'),
+                    ('trivia_response_bytes_total', 'Response body bytes sent.'))):
+                lines += ['# HELP {} {}'.format(name, help), '# TYPE {} counter'.format(name)]
+                for key, totals in sorted(self.totals.items()):
+                    lines.append('{}{{{}}} {}'.format(name, route_labels(*key), round(totals[index], 6)))
+
+        return lines
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def route_labels(method, route):
+    return 'method="{}",route="{}"'.format(escape_label(method), escape_label(route))
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    stats = g.get('request_stats') if has_request_context() else None
+    if stats is None:
+        return
+
+    stats.queries += 1
+    stats.sql_seconds += elapsed
+    if not executemany and cursor.description is not None and cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+    if stats.statements is not None and len(stats.statements) < MAX_LOGGED_STATEMENTS:
+        stats.statements.append((elapsed, statement))
+
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(context):
+    # a failed statement never reaches after_cursor_execute
+    if context.connection is not None and context.connection.info.get('query_started'):
+        context.connection.info['query_started'].pop()
+
+
+def render_metrics(app):
+    lines = app.extensions['metrics'].render()
+
+    cache = category_cache.stats()
+    lines += ['# TYPE trivia_category_cache_hits_total counter',
+              'trivia_category_cache_hits_total {}'.format(cache['hits']),
+              '# TYPE trivia_category_cache_misses_total counter',
+              'trivia_category_cache_misses_total {}'.format(cache['misses'])]
+
+    flights = app.extensions.get('single_flight')
+    if flights is not None:
+        lines += ['# HELP trivia_coalesced_requests_total Cache misses answered by another request\'s render.',
+                  '# TYPE trivia_coalesced_requests_total counter',
+                  'trivia_coalesced_requests_total{{scope="worker"}} {}'.format(flights.coalesced),
+                  'trivia_coalesced_requests_total{{scope="shared"}} {}'.format(flights.shared_coalesced)]
+
+    writes = app.extensions.get('write_queue')
+    if writes is not None:
+        lines += ['# TYPE trivia_write_groups_total counter',
+                  'trivia_write_groups_total {}'.format(writes.groups),
+                  '# TYPE trivia_write_operations_total counter',
+                  'trivia_write_operations_total {}'.format(writes.operations)]
+
+    for name, value in sorted(pool_stats().items()):
+        if isinstance(value, (int, float)):
+            lines += ['# TYPE trivia_db_pool_{} gauge'.format(name), 'trivia_db_pool_{} {}'.format(name, value)]
+
+    return '\n'.join(lines) + '\n'
+
+
+'''
+register_metrics(app)
+    times every request and counts the SQL it runs. A request slower than
+    SLOW_REQUEST_SECONDS (off when 0) is logged with the statements it ran.
+'''
+
+
+def register_metrics(app):
+    registry = app.extensions['metrics'] = MetricsRegistry()
+    slow_seconds = app.config.get('SLOW_REQUEST_SECONDS', SLOW_REQUEST_SECONDS)
+
+    @app.before_request
+    def start_request_stats():
+        g.request_stats = RequestStats(capture_statements=slow_seconds > 0)
+
+    @app.after_request
+    def record_request_stats(response):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return response
+
+        seconds = time.perf_counter() - stats.started
+        route = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        response_bytes = 0 if response.is_streamed else response.calculate_content_length() or 0
+        registry.record(request.method, route, response.status_code, stats, seconds, response_bytes)
+
+        if slow_seconds and seconds >= slow_seconds:
+            logger.warning('Slow request %s %s took %.3fs: %d queries, %.3fs SQL, %d rows\n%s',
+                           request.method, request.full_path, seconds, stats.queries, stats.sql_seconds,
+                           stats.rows, '\n'.join('  [{:.3f}s] {}'.format(elapsed, statement)
+                                                 for elapsed, statement in stats.statements))
+        return response
@@ -0,0 +1,119 @@
+import base64
+import binascii
+
+from flask import current_app
+from sqlalchemy.sql.expression import func
+
+from models import Question
+from .records import load_records
+
+QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+
+
+'''
+get_page_size(request, arg='per_page')
+    number of questions per page - the given query arg if supplied, otherwise
+    the QUESTIONS_PER_PAGE setting, never more than MAX_QUESTIONS_PER_PAGE
+'''
+
+
+def get_page_size(request, arg='per_page'):
+    default_size = current_app.config.get('QUESTIONS_PER_PAGE', QUESTIONS_PER_PAGE)
+    max_size = current_app.config.get('MAX_QUESTIONS_PER_PAGE', MAX_QUESTIONS_PER_PAGE)
+    page_size = request.args.get(arg, default_size, type=int)
+
+    return max(1, min(page_size, max_size))
+
+
+'''
+count_questions(query)
+    runs a single COUNT over a Question query (any ORDER BY is dropped)
+'''
+
+
+def count_questions(query):
+    return query.order_by(None).with_entities(func.count(Question.id)).scalar()
+
+
+'''
+paginate_questions(request, query, total=None)
+    pushes the requested page into SQL with LIMIT/OFFSET rather than loading
+    the whole selection, and returns (questions, total questions).
+    The total is only counted when the page has rows - callers 404 otherwise -
+    and not at all when the caller already knows it.
+'''
+
+
+def paginate_questions(request, query, total=None):
+    page = request.args.get('page', 1, type=int)
+    page_size = get_page_size(request)
+
+    if page < 1:
+        return [], 0
+
+    current_questions = load_records(query.limit(page_size).offset((page - 1) * page_size))
+
+    if not current_questions:
+        return current_questions, 0
+
+    return current_questions, total if total is not None else count_questions(query)
+
+
+'''
+encode_cursor(question_id) / decode_cursor(cursor)
+    opaque cursor tokens for keyset pagination. decode_cursor raises
+    ValueError for anything that wasn't produced by encode_cursor.
+'''
+
+
+def encode_cursor(question_id):
+    return base64.urlsafe_b64encode('q:{}'.format(question_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        prefix, question_id = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('invalid cursor')
+
+    if prefix != 'q' or not question_id.isdigit():
+        raise ValueError('invalid cursor')
+
+    return int(question_id)
+
+
+'''
+wants_cursor_page(request)
+    cursor mode is opt-in with ?after= and/or ?limit=, plain ?page= requests
+    keep the offset behaviour
+'''
+
+
+def wants_cursor_page(request):
+    return 'after' in request.args or 'limit' in request.args
+
+
+'''
+paginate_questions_after(request, query)
+    keyset pagination - seeks past the id in ?after= on the primary key and
+    reads one row beyond ?limit= to tell whether there is a next page, so a
+    deep page costs the same as the first. Returns (questions, next_cursor
+    or None) and raises ValueError for a bad cursor.
+'''
+
+
+def paginate_questions_after(request, query):
+    cursor = request.args.get('after', '')
+    after_id = decode_cursor(cursor) if cursor else 0
+    limit = get_page_size(request, 'limit')
+
+    selection = load_records(query.filter(Question.id > after_id).order_by(None).order_by(Question.id).limit(limit + 1))
+    current_questions = selection[:limit]
+
+    next_cursor = None
+    if len(selection) > limit:
+        next_cursor = encode_cursor(current_questions[-1].id)
+
+    return current_questions, next_cursor
@@ -0,0 +1,359 @@
+import bisect
+import random
+import threading
+import time
+
+from flask import current_app
+
+from models import db, on_change, Question
+from .records import get_record, load_records
+from .snapshot import current_snapshot
+
+QUIZ_INDEX_TTL = 60
+QUIZ_PREFETCH_MAX = 20
+
+# bucket key used for the 'ALL' category the frontend sends as id 0
+ALL_CATEGORIES = 0
+
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+ADAPTIVE_WINDOW = 5
+
+
+'''
+IdBucket
+    array of question ids plus an id -> position map, so adding, removing
+    and picking a random id are all O(1)
+'''
+
+
+class IdBucket:
+
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, question_id):
+        return question_id in self.positions
+
+    def stores(self, question_id):
+        # whether the id array holds question_id
+        return question_id in self.positions
+
+    def add(self, question_id):
+        if question_id not in self.positions:
+            self.positions[question_id] = len(self.ids)
+            self.ids.append(question_id)
+
+    def remove(self, question_id):
+        position = self.positions.pop(question_id, None)
+        if position is None:
+            return
+        # swap the last id into the hole left by the removed one
+        last = self.ids.pop()
+        if last != question_id:
+            self.ids[position] = last
+            self.positions[last] = position
+
+    '''
+    sample(exclude)
+        uniform random id that is not in exclude, or None if every id is.
+        While at least half the bucket is still unseen this is rejection
+        sampling with under two expected draws; past that point the bucket is
+        no bigger than twice the exclude set, so filtering it costs no more
+        than reading the request did.
+    '''
+
+    def sample(self, exclude):
+        total = len(self.ids)
+        remaining = total - sum(1 for question_id in exclude if self.stores(question_id))
+
+        if remaining <= 0:
+            return None
+
+        if remaining * 2 >= total:
+            while True:
+                question_id = self.ids[random.randrange(total)]
+                if question_id not in exclude:
+                    return question_id
+
+        return random.choice([question_id for question_id in self.ids if question_id not in exclude])
+
+
+'''
+SnapshotBucket
+    IdBucket over a shared snapshot's sorted id array, read in place. Ids
+    deleted in this process are masked until the next snapshot is published;
+    inserts show up with it.
+'''
+
+
+class SnapshotBucket(IdBucket):
+
+    def __init__(self, ids, removed):
+        self.ids = ids
+        self.removed = removed
+
+    def __contains__(self, question_id):
+        return self.stores(question_id) and question_id not in self.removed
+
+    def stores(self, question_id):
+        # removed ids are still in the array
+        position = bisect.bisect_left(self.ids, question_id)
+        return position < len(self.ids) and self.ids[position] == question_id
+
+    def add(self, question_id):
+        pass
+
+    def remove(self, question_id):
+        self.removed.add(question_id)
+
+    def sample(self, exclude):
+        # the masked ids count as seen - exclude is a set, so the union
+        # counts an id that is both seen and removed once
+        return super().sample(exclude | self.removed if self.removed else exclude)
+
+
+def bucket_keys(category, difficulty):
+    # the buckets a question is drawn from - all and its category, each on
+    # its own and per difficulty
+    keys = [ALL_CATEGORIES]
+    try:
+        keys.append(int(category))
+    except (TypeError, ValueError):
+        pass
+    if difficulty is not None:
+        keys += [(key, difficulty) for key in keys]
+    return keys
+
+
+def difficulty_bands(difficulty):
+    # the target band, then its neighbours outwards - 3 gives 3, 2, 4, 1, 5
+    yield difficulty
+    for distance in range(1, MAX_DIFFICULTY - MIN_DIFFICULTY + 1):
+        for band in (difficulty - distance, difficulty + distance):
+            if MIN_DIFFICULTY <= band <= MAX_DIFFICULTY:
+                yield band
+
+
+'''
+QuestionIndex
+    in-memory buckets of question ids for the quiz, one per category and one
+    per (category, difficulty). Kept fresh by the model change listener for
+    writes made in this process and reloaded every QUIZ_INDEX_TTL seconds to
+    pick up writes from other workers.
+'''
+
+
+class QuestionIndex:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = None
+        self.loaded_at = 0
+        self.snapshot = None
+
+    def is_fresh(self, ttl):
+        with self.lock:
+            return self.buckets is not None and time.monotonic() - self.loaded_at < ttl
+
+    def ensure_loaded(self, ttl):
+        snapshot = current_snapshot()
+        if snapshot is not None:
+            if snapshot is not self.snapshot:
+                self.load_snapshot(snapshot)
+        elif self.snapshot is not None or not self.is_fresh(ttl):
+            # buckets from a snapshot that is no longer used are reloaded too
+            self.load(db.session.query(Question.id, Question.category, Question.difficulty).all())
+
+    def load_snapshot(self, snapshot):
+        # every bucket shares one mask of ids deleted since the snapshot
+        removed = set()
+        buckets = {key: SnapshotBucket(ids, removed) for key, ids in snapshot.buckets.items()}
+        buckets.setdefault(ALL_CATEGORIES, IdBucket())
+
+        with self.lock:
+            self.buckets = buckets
+            self.snapshot = snapshot
+            self.loaded_at = time.monotonic()
+
+    def load(self, rows):
+        # rows of (id, category, difficulty) - the ASGI app loads them with its own driver
+        buckets = {ALL_CATEGORIES: IdBucket()}
+        for question_id, category, difficulty in rows:
+            self._add(buckets, question_id, category, difficulty)
+
+        with self.lock:
+            self.buckets = buckets
+            self.snapshot = None
+            self.loaded_at = time.monotonic()
+
+    def _add(self, buckets, question_id, category, difficulty):
+        for key in bucket_keys(category, difficulty):
+            buckets.setdefault(key, IdBucket()).add(question_id)
+
+    def add(self, question_id, category, difficulty):
+        with self.lock:
+            if self.buckets is not None:
+                self._add(self.buckets, question_id, category, difficulty)
+
+    def remove(self, question_id):
+        with self.lock:
+            if self.buckets is not None:
+                for bucket in self.buckets.values():
+                    bucket.remove(question_id)
+
+    def reset(self):
+        with self.lock:
+            self.buckets = None
+            self.snapshot = None
+
+    def sample(self, category, exclude):
+        with self.lock:
+            bucket = self.buckets.get(category) if self.buckets is not None else None
+            if bucket is None:
+                return None
+            return bucket.sample(exclude)
+
+    def sample_many(self, category, exclude, count):
+        # up to count distinct ids, in the order they were drawn
+        with self.lock:
+            bucket = self.buckets.get(category) if self.buckets is not None else None
+            if bucket is None:
+                return []
+
+            exclude = set(exclude)
+            question_ids = []
+            while len(question_ids) < count:
+                question_id = bucket.sample(exclude)
+                if question_id is None:
+                    break
+                question_ids.append(question_id)
+                exclude.add(question_id)
+            return question_ids
+
+    '''
+    sample_band(category, difficulty, exclude)
+        random unseen id from the category at the given difficulty, falling
+        back to the nearest band with one left (the easier band first on a
+        tie). Returns (id, difficulty) or (None, None).
+    '''
+
+    def sample_band(self, category, difficulty, exclude):
+        with self.lock:
+            if self.buckets is None:
+                return None, None
+            for band in difficulty_bands(difficulty):
+                bucket = self.buckets.get((category, band))
+                question_id = bucket.sample(exclude) if bucket is not None else None
+                if question_id is not None:
+                    return question_id, band
+            return None, None
+
+
+question_index = QuestionIndex()
+
+
+@on_change
+def update_question_index(instance, action):
+    if action == 'reset':
+        question_index.reset()
+    if not isinstance(instance, Question):
+        return
+    if action in ('update', 'delete'):
+        question_index.remove(instance.id)
+    if action in ('insert', 'update'):
+        question_index.add(instance.id, instance.category, instance.difficulty)
+
+
+'''
+load_questions(question_ids)
+    records for the ids in one query, in the order given - ids that no longer
+    exist are left out
+'''
+
+
+def load_questions(question_ids):
+    if not question_ids:
+        return []
+    records = {record.id: record for record in load_records(Question.query.filter(Question.id.in_(question_ids)))}
+    return [records[question_id] for question_id in question_ids if question_id in records]
+
+
+'''
+draw_questions(category, exclude, count)
+    up to count distinct random questions from the category (0 for all) whose
+    ids are not in exclude - fewer once the category runs out. The chosen
+    rows are read in one query; ids deleted by another worker are dropped
+    and redrawn.
+'''
+
+
+def draw_questions(category, exclude, count):
+    question_index.ensure_loaded(current_app.config.get('QUIZ_INDEX_TTL', QUIZ_INDEX_TTL))
+
+    exclude = set(exclude)
+    questions = []
+    while len(questions) < count:
+        question_ids = question_index.sample_many(category, exclude, count - len(questions))
+        if not question_ids:
+            break
+
+        found = load_questions(question_ids)
+        questions += found
+        exclude.update(question_ids)
+        if len(found) < len(question_ids):
+            found_ids = {question.id for question in found}
+            for question_id in question_ids:
+                if question_id not in found_ids:
+                    question_index.remove(question_id)
+
+    return questions
+
+
+'''
+target_difficulty(difficulty, recent_answers)
+    difficulty band for the next adaptive question - one harder after at
+    least 80% correct over the last ADAPTIVE_WINDOW answers, one easier at
+    40% or less, otherwise unchanged
+'''
+
+
+def target_difficulty(difficulty, recent_answers):
+    recent = recent_answers[-ADAPTIVE_WINDOW:]
+    difficulty = max(MIN_DIFFICULTY, min(difficulty, MAX_DIFFICULTY))
+    if not recent:
+        return difficulty
+
+    accuracy = sum(1 for correct in recent if correct) / len(recent)
+    if accuracy >= 0.8:
+        return min(difficulty + 1, MAX_DIFFICULTY)
+    if accuracy <= 0.4:
+        return max(difficulty - 1, MIN_DIFFICULTY)
+    return difficulty
+
+
+'''
+draw_adaptive_question(category, exclude, difficulty)
+    like draw_questions for one question, but from the given difficulty band or the nearest
+    one with questions left. Returns (question, band), band being the difficulty actually
+    served, or (None, None). The draw costs O(len(exclude)) whatever the bank size.
+'''
+
+
+def draw_adaptive_question(category, exclude, difficulty):
+    question_index.ensure_loaded(current_app.config.get('QUIZ_INDEX_TTL', QUIZ_INDEX_TTL))
+
+    while True:
+        question_id, band = question_index.sample_band(category, difficulty, exclude)
+        if question_id is None:
+            return None, None
+
+        question = get_record(question_id)
+        if question is not None:
+            return question, band
+
+        question_index.remove(question_id)
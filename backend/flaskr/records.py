@@ -0,0 +1,49 @@
+from models import db, Question
+
+RECORD_COLUMNS = (Question.id, Question.question, Question.answer, Question.category, Question.difficulty)
+
+
+'''
+QuestionRecord
+    read-only question row for the read paths. Loaded straight from the
+    result rows, without the identity map, attribute instrumentation or
+    session bookkeeping of a Question instance. format() gives the same JSON
+    shape as Question.format(); writes still go through Question.
+'''
+
+
+class QuestionRecord:
+    __slots__ = ('id', 'question', 'answer', 'category', 'difficulty')
+
+    def __init__(self, id, question, answer, category, difficulty):
+        self.id = id
+        self.question = question
+        self.answer = answer
+        self.category = category
+        self.difficulty = difficulty
+
+    def format(self):
+        return {
+            'id': self.id,
+            'question': self.question,
+            'answer': self.answer,
+            'category': self.category,
+            'difficulty': self.difficulty
+        }
+
+
+'''
+load_records(query)
+    runs a Question query (filters, order, limit and offset are kept) for just
+    the formatted columns and returns QuestionRecords
+'''
+
+
+def load_records(query):
+    rows = db.session.execute(query.with_entities(*RECORD_COLUMNS).statement)
+    return [QuestionRecord(*row) for row in rows]
+
+
+def get_record(question_id):
+    records = load_records(Question.query.filter(Question.id == question_id))
+    return records[0] if records else None
@@ -0,0 +1,118 @@
+'''
+Read replica routing
+
+With DB_REPLICA_URLS set, the reads of views marked with @replica_reads go
+to a replica, picked round robin per request; everything else, and every
+write, goes to the primary. A replica whose connection fails is skipped for
+DB_REPLICA_COOLDOWN seconds (the request that hit the failure still fails);
+with every replica cooling down, reads fall back to the primary.
+
+Replicas lag the primary, so a client that has just written sticks to the
+primary for DB_READ_YOUR_WRITES_SECONDS through a short-lived cookie, and
+its reads skip the response cache. Other clients can read slightly stale
+rows for that long - pages rendered from a replica in that window after a
+write are not cached, and the in-process quiz index and counts may drop or
+miss a new question until their next reload.
+'''
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+
+from models import db, get_setting
+
+DB_REPLICA_COOLDOWN = 30
+DB_READ_YOUR_WRITES_SECONDS = 5
+PRIMARY_COOKIE = 'trivia_primary'
+
+
+def replica_reads(view):
+    # marks a view whose reads may be served by a replica
+    view.replica_reads = True
+    return view
+
+
+def pinned_to_primary():
+    # this request has written, or its client did within DB_READ_YOUR_WRITES_SECONDS
+    return bool(g.get('db_wrote')) or PRIMARY_COOKIE in request.cookies
+
+
+'''
+ReplicaSet
+    the replica binds of an app, handed out round robin. Engines are created
+    on first use and each one takes itself out of the rotation for cooldown
+    seconds when connecting to it fails or drops.
+'''
+
+
+class ReplicaSet:
+
+    def __init__(self, app, binds, cooldown, read_your_writes=DB_READ_YOUR_WRITES_SECONDS):
+        self.app = app
+        self.binds = binds
+        self.cooldown = cooldown
+        self.read_your_writes = read_your_writes
+        self.lock = threading.Lock()
+        self.next = 0
+        self.engines = {}
+        self.down_until = {}
+        self.requests = {bind: 0 for bind in binds}
+
+    def engine(self, bind):
+        engine = self.engines.get(bind)
+        if engine is None:
+            engine = self.engines[bind] = db.get_engine(self.app, bind=bind)
+
+            @event.listens_for(engine, 'handle_error')
+            def take_out_of_rotation(context):
+                if context.is_disconnect or context.connection is None:
+                    self.mark_down(bind)
+        return engine
+
+    def mark_down(self, bind):
+        with self.lock:
+            self.down_until[bind] = time.monotonic() + self.cooldown
+        self.app.logger.warning('Read replica %s failed, skipping it for %ss', bind, self.cooldown)
+
+    def choose(self):
+        with self.lock:
+            now = time.monotonic()
+            for step in range(len(self.binds)):
+                bind = self.binds[(self.next + step) % len(self.binds)]
+                if self.down_until.get(bind, 0) <= now:
+                    self.next = (self.next + step + 1) % len(self.binds)
+                    self.requests[bind] += 1
+                    break
+            else:
+                return None
+            return self.engine(bind)
+
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return {bind: {'healthy': self.down_until.get(bind, 0) <= now, 'requests': self.requests[bind]}
+                    for bind in self.binds}
+
+
+def register_replica_routing(app):
+    binds = sorted((bind for bind in app.config.get('SQLALCHEMY_BINDS') or () if bind.startswith('replica_')),
+                   key=lambda bind: int(bind[len('replica_'):]))
+    if not binds:
+        return
+
+    window = get_setting(app, 'DB_READ_YOUR_WRITES_SECONDS', DB_READ_YOUR_WRITES_SECONDS, int)
+    replicas = app.extensions['db_replicas'] = ReplicaSet(
+        app, binds, get_setting(app, 'DB_REPLICA_COOLDOWN', DB_REPLICA_COOLDOWN, float), window)
+
+    @app.before_request
+    def choose_replica():
+        view = app.view_functions.get(request.endpoint)
+        if getattr(view, 'replica_reads', False) and not pinned_to_primary():
+            g.db_replica = replicas.choose()
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('db_wrote') and window > 0:
+            response.set_cookie(PRIMARY_COOKIE, '1', max_age=window, httponly=True)
+        return response
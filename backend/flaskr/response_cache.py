@@ -0,0 +1,316 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_app_context, request
+
+from models import on_change
+from .compression import etag_matches
+from .replicas import pinned_to_primary
+
+RESPONSE_CACHE = 'memory'
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL = 300
+# the in-process cache only sees this worker's writes, so it is kept short
+RESPONSE_CACHE_LOCAL_TTL = 5
+REQUEST_COALESCING = 'local'
+REQUEST_COALESCING_TIMEOUT = 10
+
+
+'''
+MemoryResponseCache
+    LRU of rendered responses for this process. Entries are keyed by the data
+    version, so bumping it makes every older entry unreachable - but only
+    this worker's writes bump it, so entries are also dropped after ttl
+    seconds (RESPONSE_CACHE_LOCAL_TTL) to bound staleness from other
+    workers' writes.
+'''
+
+
+class MemoryResponseCache:
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_LOCAL_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.version = 0
+        self.bumped_at = float('-inf')
+
+    def get_version(self):
+        return self.version
+
+    def bump_version(self):
+        with self.lock:
+            self.version += 1
+            self.bumped_at = time.monotonic()
+            self.entries.clear()
+
+    def seconds_since_bump(self):
+        return time.monotonic() - self.bumped_at
+
+    def get(self, key):
+        with self.lock:
+            stored_at, entry = self.entries.get(key, (0, None))
+            if entry is None or time.monotonic() - stored_at >= self.ttl:
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), entry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+'''
+RedisResponseCache
+    rendered responses and the data version in a Redis-compatible server, so
+    every worker shares one cache and sees every other worker's writes.
+    Needs the optional redis package.
+'''
+
+
+class RedisResponseCache:
+
+    def __init__(self, url, ttl=RESPONSE_CACHE_TTL, prefix='trivia:response:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def get_version(self):
+        return int(self.client.get(self.prefix + 'version') or 0)
+
+    def bump_version(self):
+        with self.client.pipeline() as pipeline:
+            pipeline.incr(self.prefix + 'version')
+            pipeline.set(self.prefix + 'bumped_at', time.time())
+            pipeline.execute()
+
+    def seconds_since_bump(self):
+        bumped_at = self.client.get(self.prefix + 'bumped_at')
+        return time.time() - float(bumped_at) if bumped_at is not None else float('inf')
+
+    def get(self, key):
+        stored = self.client.get(self.prefix + key)
+        if stored is None:
+            return None
+        etag, mimetype, body = stored.split(b'\n', 2)
+        return etag.decode(), body, mimetype.decode()
+
+    def set(self, key, entry):
+        etag, body, mimetype = entry
+        self.client.set(self.prefix + key, b'\n'.join([etag.encode(), mimetype.encode(), body]), ex=self.ttl)
+
+    def acquire(self, key, timeout):
+        # one worker renders a missing entry; the lock expires if it dies
+        return bool(self.client.set(self.prefix + 'lock:' + key, 1, nx=True, px=int(timeout * 1000)))
+
+    def release(self, key):
+        self.client.delete(self.prefix + 'lock:' + key)
+
+    def wait(self, key, timeout):
+        # the entry the lock holder stores, or None if it stored none in time
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            entry = self.get(key)
+            if entry is not None:
+                return entry
+            if not self.client.exists(self.prefix + 'lock:' + key):
+                return self.get(key)
+            time.sleep(0.01)
+        return None
+
+
+def create_response_cache(config):
+    backend = config.get('RESPONSE_CACHE', RESPONSE_CACHE)
+
+    if backend == 'none':
+        return None
+    if backend == 'memory':
+        return MemoryResponseCache(config.get('RESPONSE_CACHE_SIZE', RESPONSE_CACHE_SIZE),
+                                   config.get('RESPONSE_CACHE_LOCAL_TTL', RESPONSE_CACHE_LOCAL_TTL))
+    if backend.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisResponseCache(backend, config.get('RESPONSE_CACHE_TTL', RESPONSE_CACHE_TTL))
+
+    raise ValueError('Unknown RESPONSE_CACHE: {}'.format(backend))
+
+
+'''
+SingleFlight
+    runs at most one render per key at a time in this process - requests for
+    a key that is already being rendered wait for that render and share its
+    entry. coalesced counts the requests answered that way, shared those
+    answered by another worker's render.
+'''
+
+
+class Flight:
+    __slots__ = ('done', 'entry')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+class SingleFlight:
+
+    def __init__(self, timeout=REQUEST_COALESCING_TIMEOUT, shared=False):
+        self.timeout = timeout
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.coalesced = 0
+        self.shared_coalesced = 0
+
+    def run(self, key, render, cache=None):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+
+        if leader:
+            try:
+                flight.entry = self.render_shared(key, render, cache) if self.shared else render()
+                return flight.entry
+            finally:
+                with self.lock:
+                    del self.flights[key]
+                flight.done.set()
+
+        # a failed, uncacheable or too slow render leaves the caller to its own
+        if flight.done.wait(self.timeout) and flight.entry is not None:
+            with self.lock:
+                self.coalesced += 1
+            return flight.entry
+        return None
+
+    def render_shared(self, key, render, cache):
+        # one worker renders; the others wait for it to store the entry
+        acquired = cache.acquire(key, self.timeout)
+        if not acquired:
+            entry = cache.wait(key, self.timeout)
+            if entry is not None:
+                with self.lock:
+                    self.shared_coalesced += 1
+                return entry
+        try:
+            return render()
+        finally:
+            if acquired:
+                cache.release(key)
+
+
+def create_single_flight(config):
+    mode = config.get('REQUEST_COALESCING', REQUEST_COALESCING)
+    timeout = config.get('REQUEST_COALESCING_TIMEOUT', REQUEST_COALESCING_TIMEOUT)
+
+    if mode == 'none':
+        return None
+    if mode == 'local':
+        return SingleFlight(timeout)
+    if mode == 'shared':
+        # workers coordinate through the shared response cache
+        if not config.get('RESPONSE_CACHE', RESPONSE_CACHE).startswith(('redis://', 'rediss://', 'unix://')):
+            raise ValueError('REQUEST_COALESCING shared needs a Redis RESPONSE_CACHE')
+        return SingleFlight(timeout, shared=True)
+
+    raise ValueError('Unknown REQUEST_COALESCING: {}'.format(mode))
+
+
+@on_change
+def bump_data_version(instance, action):
+    # any committed write makes every cached response stale
+    if has_app_context():
+        cache = current_app.extensions.get('response_cache')
+        if cache is not None:
+            cache.bump_version()
+
+
+'''
+get_data_version()
+    version stamp of the question/category data, bumped on every write
+'''
+
+
+def get_data_version():
+    cache = current_app.extensions.get('response_cache')
+    return cache.get_version() if cache is not None else None
+
+
+def cache_key(version):
+    args = '&'.join('{}={}'.format(key, value) for key, value in sorted(request.args.items(multi=True)))
+    return '{}:{}?{}'.format(version, request.path, args)
+
+
+def response_entry(response):
+    if response.status_code != 200 or response.is_streamed:
+        return None
+    body = response.get_data()
+    return hashlib.sha1(body).hexdigest(), body, response.mimetype
+
+
+'''
+cached_response
+    decorator for read-only views. A 200 response is stored with a strong ETag
+    under the route, query args and data version; repeats are served from the
+    cache without touching the database or the serializer, and a matching
+    If-None-Match (for the plain or a compressed body) gets an empty 304.
+    Concurrent misses for the same key are rendered once (REQUEST_COALESCING) -
+    in this process, or across workers sharing a Redis cache with 'shared'.
+    With read replicas, a client pinned to the primary bypasses the cache, and
+    a page rendered from a replica soon after a write is not stored - the
+    replica may not have the write yet.
+'''
+
+
+def cached_response(view):
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = current_app.extensions.get('response_cache')
+        flights = current_app.extensions.get('single_flight')
+        replicas = current_app.extensions.get('db_replicas')
+        if cache is None and flights is None or replicas is not None and pinned_to_primary():
+            return view(*args, **kwargs)
+
+        key = cache_key(cache.get_version() if cache is not None else None)
+        entry = cache.get(key) if cache is not None else None
+
+        if entry is None:
+            response = None
+
+            def render():
+                nonlocal response
+                response = current_app.make_response(view(*args, **kwargs))
+                entry = response_entry(response)
+                if entry is not None and cache is not None and not (
+                        g.get('db_replica') is not None
+                        and cache.seconds_since_bump() < replicas.read_your_writes):
+                    cache.set(key, entry)
+                return entry
+
+            entry = flights.run(key, render, cache) if flights is not None else render()
+            if entry is None:
+                # an error or streamed response is this request's own
+                return response if response is not None else view(*args, **kwargs)
+
+        etag, body, mimetype = entry
+        if etag_matches(request.if_none_match, etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(body, mimetype=mimetype)
+
+        response.set_etag(etag)
+        # let browsers keep the body but always revalidate it with the ETag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    return wrapper
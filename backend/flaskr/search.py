@@ -0,0 +1,232 @@
+import threading
+import time
+import weakref
+
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.sql.expression import func
+
+from models import db, on_change, Question
+from .pagination import get_page_size, paginate_questions
+from .records import load_records
+
+SEARCH_BACKEND = 'auto'
+SEARCH_INCLUDE_ANSWERS = False
+SEARCH_INDEX_TTL = 60
+
+TRIGRAM_CHECK = "SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+'''
+TextIndex
+    in-process trigram inverted index over question (and optionally answer)
+    text for databases without pg_trgm. A search intersects the posting sets
+    of the term's trigrams and checks the few candidates for the substring,
+    so it keeps the case-insensitive 'contains' semantics of the ILIKE search.
+    (On Postgres the pg_trgm indexes come from migration 0001.)
+    Updated incrementally by the model change listener and reloaded every
+    SEARCH_INDEX_TTL seconds to pick up writes from other workers.
+'''
+
+
+class TextIndex:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.texts = None
+        self.grams = None
+        self.include_answers = False
+        self.loaded_at = 0
+
+    def ensure_loaded(self, ttl, include_answers):
+        # returns (texts, grams) to search - a concurrent reset drops them
+        # from the index, but not from the caller
+        with self.lock:
+            if self.texts is not None and self.include_answers == include_answers \
+                    and time.monotonic() - self.loaded_at < ttl:
+                return self.texts, self.grams
+
+        columns = [Question.id, Question.question]
+        if include_answers:
+            columns.append(Question.answer)
+
+        texts, grams = {}, {}
+        for row in db.session.query(*columns).all():
+            self._add(texts, grams, row[0], ' '.join(text or '' for text in row[1:]))
+
+        with self.lock:
+            self.texts = texts
+            self.grams = grams
+            self.include_answers = include_answers
+            self.loaded_at = time.monotonic()
+        return texts, grams
+
+    def _add(self, texts, grams, question_id, text):
+        text = text.lower()
+        texts[question_id] = text
+        for gram in trigrams(text):
+            grams.setdefault(gram, set()).add(question_id)
+
+    def _remove(self, question_id):
+        text = self.texts.pop(question_id, None)
+        if text is None:
+            return
+        for gram in trigrams(text):
+            postings = self.grams.get(gram)
+            if postings is not None:
+                postings.discard(question_id)
+                if not postings:
+                    del self.grams[gram]
+
+    def add(self, question):
+        with self.lock:
+            if self.texts is not None:
+                self._remove(question.id)
+                text = question.question or ''
+                if self.include_answers:
+                    text += ' ' + (question.answer or '')
+                self._add(self.texts, self.grams, question.id, text)
+
+    def remove(self, question_id):
+        with self.lock:
+            if self.texts is not None:
+                self._remove(question_id)
+
+    def reset(self):
+        with self.lock:
+            self.texts = None
+            self.grams = None
+
+    '''
+    search(term, loaded)
+        ids of every question containing term, best match first - a match at
+        the start of a word beats one inside a word, then shorter texts win.
+        Searches loaded, as returned by ensure_loaded, when given.
+    '''
+
+    def search(self, term, loaded=None):
+        term = term.lower()
+
+        with self.lock:
+            texts, grams = (self.texts, self.grams) if loaded is None else loaded
+            if len(term) < 3:
+                candidates = texts.keys()
+            else:
+                postings = sorted((grams.get(gram, set()) for gram in trigrams(term)), key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+
+            ranked = []
+            for question_id in candidates:
+                text = texts[question_id]
+                position = text.find(term)
+                if position >= 0:
+                    inside_word = position > 0 and text[position - 1].isalnum()
+                    ranked.append((inside_word, len(text), question_id))
+
+        ranked.sort()
+        return [question_id for inside_word, length, question_id in ranked]
+
+
+text_index = TextIndex()
+
+
+@on_change
+def update_text_index(instance, action):
+    if action == 'reset':
+        text_index.reset()
+    if not isinstance(instance, Question):
+        return
+    if action == 'delete':
+        text_index.remove(instance.id)
+    else:
+        text_index.add(instance)
+
+
+trigram_support = weakref.WeakKeyDictionary()
+
+
+'''
+has_trigram_support(engine)
+    whether pg_trgm is installed in the engine's database, checked once per
+    engine. Migration 0001 installs it, but only where the migrating role may
+    CREATE EXTENSION.
+'''
+
+
+def has_trigram_support(engine):
+    supported = trigram_support.get(engine)
+    if supported is None:
+        supported = engine.dialect.name == 'postgresql' and bool(engine.scalar(TRIGRAM_CHECK))
+        trigram_support[engine] = supported
+    return supported
+
+
+'''
+get_search_backend()
+    'postgres' (ILIKE ranked by word_similarity()), 'ilike' (plain ILIKE in
+    id order, for databases without pg_trgm) or 'memory' (the TextIndex).
+    'auto' picks postgres on Postgres and memory elsewhere, and postgres
+    falls back to ilike when pg_trgm is missing.
+'''
+
+
+def get_search_backend():
+    backend = current_app.config.get('SEARCH_BACKEND', SEARCH_BACKEND)
+    if backend == 'auto':
+        backend = 'postgres' if db.engine.dialect.name == 'postgresql' else 'memory'
+    if backend == 'postgres' and not has_trigram_support(db.engine):
+        return 'ilike'
+    return backend
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+'''
+search_questions(request, search_term)
+    one page of questions containing search_term, best match first, as
+    (questions, total matches). Postgres filters with an ILIKE the
+    trigram indexes can serve and ranks with word_similarity(), or orders
+    by id without pg_trgm; other databases use the in-process TextIndex
+    and only load the page's rows.
+'''
+
+
+def search_questions(request, search_term):
+    include_answers = current_app.config.get('SEARCH_INCLUDE_ANSWERS', SEARCH_INCLUDE_ANSWERS)
+
+    backend = get_search_backend()
+    if backend in ('postgres', 'ilike'):
+        pattern = '%' + escape_like(search_term) + '%'
+        match = Question.question.ilike(pattern, escape='\\')
+        if include_answers:
+            match = or_(match, Question.answer.ilike(pattern, escape='\\'))
+
+        selection = Question.query.filter(match)
+        if backend == 'postgres':
+            selection = selection.order_by(func.word_similarity(search_term, Question.question).desc(), Question.id)
+        else:
+            selection = selection.order_by(Question.id)
+        return paginate_questions(request, selection)
+
+    loaded = text_index.ensure_loaded(current_app.config.get('SEARCH_INDEX_TTL', SEARCH_INDEX_TTL), include_answers)
+    ranked = text_index.search(search_term, loaded)
+
+    page = request.args.get('page', 1, type=int)
+    page_size = get_page_size(request)
+    if page < 1:
+        return [], 0
+
+    page_ids = ranked[(page - 1) * page_size:page * page_size]
+    if not page_ids:
+        return [], 0
+
+    questions = {question.id: question for question in load_records(Question.query.filter(Question.id.in_(page_ids)))}
+    current_questions = [questions[question_id] for question_id in page_ids if question_id in questions]
+
+    return current_questions, len(ranked)
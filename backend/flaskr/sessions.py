@@ -0,0 +1,150 @@
+import random
+import secrets
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from flask import current_app
+
+from .quiz import QUIZ_INDEX_TTL, load_questions, question_index
+
+QUIZ_SESSION_STORE = 'memory'
+QUIZ_SESSION_TTL = 3600
+QUIZ_SESSION_MAX = 10000
+QUIZ_SESSION_LENGTH = 500
+
+
+'''
+MemorySessionStore
+    quiz sessions held in this process - a shuffled int array of the question
+    ids still to be served per token, evicted least recently used first once
+    there are more than max_sessions, or after ttl seconds without a request
+'''
+
+
+class MemorySessionStore:
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_sessions=QUIZ_SESSION_MAX):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+
+    def create(self, token, question_ids):
+        with self.lock:
+            self.sessions[token] = (time.monotonic() + self.ttl, array('i', question_ids))
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+
+    def pop(self, token, count=1):
+        # the next count ids (fewer at the end of the session) in serving order
+        with self.lock:
+            expires_at, remaining = self.sessions.get(token, (0, None))
+            if expires_at < time.monotonic():
+                self.sessions.pop(token, None)
+                raise KeyError(token)
+
+            self.sessions[token] = (time.monotonic() + self.ttl, remaining)
+            self.sessions.move_to_end(token)
+            question_ids = remaining[-count:][::-1].tolist()
+            del remaining[-count:]
+            return question_ids
+
+
+'''
+RedisSessionStore
+    quiz sessions in any Redis-compatible server, so every worker sees them.
+    Each session is a list popped with RPOP plus a marker key, both expiring
+    ttl seconds after the last request; the server's maxmemory policy handles
+    eviction. Needs the optional redis package.
+'''
+
+
+class RedisSessionStore:
+
+    def __init__(self, url, ttl=QUIZ_SESSION_TTL, prefix='trivia:quiz:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+
+    def create(self, token, question_ids):
+        key = self.prefix + token
+        pipe = self.client.pipeline()
+        pipe.set(key + ':live', 1, ex=self.ttl)
+        if question_ids:
+            pipe.rpush(key, *question_ids)
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def pop(self, token, count=1):
+        # read and trim the tail in one MULTI, so concurrent pops never
+        # hand out the same id
+        key = self.prefix + token
+        pipe = self.client.pipeline()
+        pipe.expire(key + ':live', self.ttl)
+        pipe.expire(key, self.ttl)
+        pipe.lrange(key, -count, -1)
+        pipe.ltrim(key, 0, -count - 1)
+        live, _, question_ids, _ = pipe.execute()
+        if not live:
+            raise KeyError(token)
+
+        return [int(question_id) for question_id in reversed(question_ids)]
+
+
+def create_session_store(config):
+    store = config.get('QUIZ_SESSION_STORE', QUIZ_SESSION_STORE)
+    ttl = config.get('QUIZ_SESSION_TTL', QUIZ_SESSION_TTL)
+
+    if store == 'memory':
+        return MemorySessionStore(ttl, config.get('QUIZ_SESSION_MAX', QUIZ_SESSION_MAX))
+    if store.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisSessionStore(store, ttl)
+
+    raise ValueError('Unknown QUIZ_SESSION_STORE: {}'.format(store))
+
+
+'''
+start_session(category)
+    picks up to QUIZ_SESSION_LENGTH questions from the category (0 for all)
+    in random order and stores them under a new token. Returns
+    (token, number of questions in the session).
+'''
+
+
+def start_session(category):
+    question_index.ensure_loaded(current_app.config.get('QUIZ_INDEX_TTL', QUIZ_INDEX_TTL))
+    length = current_app.config.get('QUIZ_SESSION_LENGTH', QUIZ_SESSION_LENGTH)
+
+    with question_index.lock:
+        # a bulk import may have reset the index since it was loaded
+        bucket = question_index.buckets.get(category) if question_index.buckets is not None else None
+        question_ids = random.sample(bucket.ids, min(length, len(bucket))) if bucket else []
+
+    token = secrets.token_urlsafe(16)
+    current_app.extensions['quiz_sessions'].create(token, question_ids)
+
+    return token, len(question_ids)
+
+
+'''
+next_session_questions(token, count=1)
+    the next count questions of the session, read in one query - fewer, or
+    none, once it is used up. Raises KeyError for an unknown or expired
+    token. Questions deleted since the session started are skipped.
+'''
+
+
+def next_session_questions(token, count=1):
+    store = current_app.extensions['quiz_sessions']
+
+    questions = []
+    while len(questions) < count:
+        question_ids = store.pop(token, count - len(questions))
+        if not question_ids:
+            break
+        questions += load_questions(question_ids)
+    return questions
@@ -0,0 +1,276 @@
+'''
+Shared read snapshot for multi-process servers
+
+With SNAPSHOT_PATH set, the category map, the question counts and the quiz
+id buckets are published to one memory-mapped file instead of being loaded
+by every worker. Build it once in the master before the workers fork:
+
+    SNAPSHOT_PATH=/run/trivia/snapshot.bin gunicorn --preload -w 8 'flaskr:create_app()'
+
+or with 'flask build-snapshot' from a loader process. create_app() rebuilds
+it on start rather than trusting a file left from an earlier run, and
+'flask import-questions' rebuilds it once the import is done. Writes made
+through the models schedule a rebuild SNAPSHOT_REBUILD_DELAY seconds later.
+Each build is written to a temporary file and renamed over the old one, so
+readers see either the previous snapshot or the new one, never a partial
+file. Workers notice the new file within SNAPSHOT_CHECK_SECONDS and map it;
+the id arrays are read in place through memoryviews, so the pages are shared
+by every process.
+
+Writes from processes that exit before their rebuild runs, or made outside
+the models, are bounded by SNAPSHOT_MAX_AGE: a worker reading a snapshot
+older than half of it rebuilds it in the background, and one older than it
+is not used at all - readers fall back to their own TTL-bound loads from the
+database until a newer one is published. Builds take an exclusive lock on
+'<SNAPSHOT_PATH>.lock', so workers that find the same old snapshot rebuild
+it once.
+
+File layout: header (magic, format, data version, metadata length), JSON
+metadata (categories, counts, bucket offsets), then the int32 id arrays.
+'''
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+import click
+from flask import current_app, has_app_context
+
+from models import db, on_change, Category, Question
+from . import encoding
+
+SNAPSHOT_PATH = ''
+SNAPSHOT_CHECK_SECONDS = 1
+SNAPSHOT_REBUILD_DELAY = 1
+SNAPSHOT_MAX_AGE = 60
+
+MAGIC = b'TRVS'
+FORMAT = 1
+HEADER = struct.Struct('<4sIQQ')
+
+
+def encode_key(key):
+    return list(key) if isinstance(key, tuple) else key
+
+
+def decode_key(key):
+    return tuple(key) if isinstance(key, list) else key
+
+
+'''
+write_snapshot(path, version, categories, counts, buckets)
+    writes and atomically publishes a snapshot - categories is {'<id>': type},
+    counts is [(category, difficulty, count)] and buckets maps each quiz bucket
+    key to an array('i') of ids in ascending order
+'''
+
+
+def write_snapshot(path, version, categories, counts, buckets):
+    offsets = []
+    position = 0
+    for key, ids in buckets.items():
+        offsets.append([encode_key(key), position, len(ids)])
+        position += len(ids) * ids.itemsize
+
+    metadata = json.dumps({'categories': categories, 'counts': counts, 'buckets': offsets}).encode('utf-8')
+    # start the id arrays on an 8 byte boundary
+    padding = b'\0' * (-(HEADER.size + len(metadata)) % 8)
+
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, FORMAT, version, len(metadata) + len(padding)))
+        out.write(metadata + padding)
+        for ids in buckets.values():
+            ids.tofile(out)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(temporary, path)
+
+
+'''
+Snapshot
+    a published snapshot mapped read-only. buckets maps each quiz bucket key
+    to a memoryview of its ids, straight over the mapped pages.
+'''
+
+
+class Snapshot:
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot:
+            stat = os.fstat(snapshot.fileno())
+            self.map = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+        self.published_at = stat.st_mtime
+
+        magic, format, self.version, metadata_length = HEADER.unpack_from(self.map)
+        if magic != MAGIC or format != FORMAT:
+            raise ValueError('{} is not a trivia snapshot'.format(path))
+
+        metadata = json.loads(self.map[HEADER.size:HEADER.size + metadata_length].rstrip(b'\0').decode('utf-8'))
+        self.categories = metadata['categories']
+        self.fragment = encoding.dumps(self.categories)
+        self.counts = [tuple(row) for row in metadata['counts']]
+
+        view = memoryview(self.map)[HEADER.size + metadata_length:]
+        self.buckets = {}
+        for key, offset, length in metadata['buckets']:
+            self.buckets[decode_key(key)] = view[offset:offset + length * 4].cast('i')
+
+
+class SnapshotReader:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.checked_at = 0
+
+    def get(self, path, check_seconds):
+        with self.lock:
+            now = time.monotonic()
+            if self.snapshot is not None and now - self.checked_at < check_seconds:
+                return self.snapshot
+            self.checked_at = now
+
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self.snapshot = None
+                return None
+
+            if self.snapshot is None or self.snapshot.identity != (stat.st_ino, stat.st_mtime_ns):
+                # the old mapping is released once nothing uses its buckets
+                self.snapshot = Snapshot(path)
+            return self.snapshot
+
+
+snapshot_reader = SnapshotReader()
+
+
+'''
+current_snapshot()
+    the latest published snapshot, or None when SNAPSHOT_PATH is not set,
+    nothing has been published yet or the snapshot is older than
+    SNAPSHOT_MAX_AGE (callers then load from the database)
+'''
+
+
+def current_snapshot():
+    path = current_app.config.get('SNAPSHOT_PATH', SNAPSHOT_PATH)
+    if not path:
+        return None
+    snapshot = snapshot_reader.get(path, current_app.config.get('SNAPSHOT_CHECK_SECONDS', SNAPSHOT_CHECK_SECONDS))
+    if snapshot is None:
+        return None
+
+    max_age = current_app.config.get('SNAPSHOT_MAX_AGE', SNAPSHOT_MAX_AGE)
+    if max_age:
+        age = time.time() - snapshot.published_at
+        if age >= max_age / 2:
+            # rebuilt ahead of the limit, so readers normally never reach it
+            rebuild_scheduler.schedule(current_app._get_current_object(), 0, max_age / 2)
+        if age >= max_age:
+            return None
+    return snapshot
+
+
+'''
+build_snapshot(path, older_than=None)
+    reads the categories and every question's (id, category, difficulty)
+    through a server-side cursor and publishes a new snapshot version. With
+    older_than, a snapshot published less than that many seconds ago is kept
+    and None returned.
+'''
+
+
+def build_snapshot(path, older_than=None):
+    with open(path + '.lock', 'a') as lock:
+        # held until the new file is in place
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if older_than is not None and snapshot_age(path) < older_than:
+            return None
+        return _build_snapshot(path)
+
+
+def snapshot_age(path):
+    try:
+        return time.time() - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return float('inf')
+
+
+def _build_snapshot(path):
+    # quiz imports this module for current_snapshot()
+    from .quiz import bucket_keys
+
+    categories = {str(category.id): category.type for category in Category.query.order_by(Category.id).all()}
+    counts = {}
+    buckets = {}
+
+    selection = db.session.query(Question.id, Question.category, Question.difficulty).order_by(Question.id) \
+        .execution_options(stream_results=True).yield_per(10000)
+    for question_id, category, difficulty in selection:
+        counts[(category, difficulty)] = counts.get((category, difficulty), 0) + 1
+        for key in bucket_keys(category, difficulty):
+            buckets.setdefault(key, array('i')).append(question_id)
+
+    try:
+        version = Snapshot(path).version + 1
+    except (OSError, ValueError):
+        version = 1
+
+    write_snapshot(path, version, categories,
+                   [[category, difficulty, count] for (category, difficulty), count in counts.items()], buckets)
+    return version
+
+
+class RebuildScheduler:
+    # coalesces the rebuilds asked for by a burst of writes into one
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def schedule(self, app, delay, older_than=None):
+        with self.lock:
+            if self.timer is not None:
+                return
+            self.timer = threading.Timer(delay, self.rebuild, args=(app, older_than))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def rebuild(self, app, older_than=None):
+        with self.lock:
+            self.timer = None
+        with app.app_context():
+            try:
+                build_snapshot(app.config['SNAPSHOT_PATH'], older_than)
+            except Exception:
+                app.logger.warning('Unable to rebuild the read snapshot', exc_info=True)
+            finally:
+                db.session.remove()
+
+
+rebuild_scheduler = RebuildScheduler()
+
+
+@on_change
+def schedule_snapshot_rebuild(instance, action):
+    if has_app_context() and current_app.config.get('SNAPSHOT_PATH'):
+        rebuild_scheduler.schedule(current_app._get_current_object(),
+                                   current_app.config.get('SNAPSHOT_REBUILD_DELAY', SNAPSHOT_REBUILD_DELAY))
+
+
+def register_snapshot_commands(app):
+
+    @app.cli.command('build-snapshot')
+    def build_snapshot_command():
+        """Publish the shared read snapshot to SNAPSHOT_PATH."""
+        path = app.config.get('SNAPSHOT_PATH')
+        if not path:
+            raise click.UsageError('SNAPSHOT_PATH is not set')
+        click.echo('Published snapshot version {} to {}'.format(build_snapshot(path), path))
@@ -0,0 +1,148 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy.sql.expression import func
+
+from models import db, on_change, Category, Question
+from .snapshot import current_snapshot
+
+QUESTION_STATS_TTL = 60
+
+
+'''
+QuestionStats
+    question counts per (category, difficulty), loaded with one GROUP BY and
+    then kept up to date by the model change listener - inserts and deletes
+    in this process adjust the counts as they commit, an update reloads them.
+    Reloaded every QUESTION_STATS_TTL seconds to pick up writes from other
+    workers, so totals cost nothing at any table size.
+'''
+
+
+class QuestionStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = None
+        self.loaded_at = 0
+        self.snapshot = None
+
+    def is_fresh(self, ttl):
+        with self.lock:
+            return self.counts is not None and time.monotonic() - self.loaded_at < ttl
+
+    def ensure_loaded(self, ttl):
+        # returns the counts to answer from - a concurrent reset drops
+        # self.counts, but not the caller's reference to them
+        with self.lock:
+            if self.counts is not None and self.snapshot is None and time.monotonic() - self.loaded_at < ttl:
+                return self.counts
+        return self.load(db.session.query(Question.category, Question.difficulty, func.count(Question.id))
+                         .group_by(Question.category, Question.difficulty).all())
+
+    def ensure_snapshot(self, snapshot):
+        # like ensure_loaded, from a shared snapshot
+        with self.lock:
+            if self.counts is not None and self.snapshot is snapshot:
+                return self.counts
+        return self.load_snapshot(snapshot)
+
+    def load(self, rows):
+        # rows of (category, difficulty, count) - the ASGI app loads them with its own driver
+        counts = {}
+        for category, difficulty, count in rows:
+            counts[(category, difficulty)] = counts.get((category, difficulty), 0) + count
+
+        with self.lock:
+            self.counts = counts
+            self.snapshot = None
+            self.loaded_at = time.monotonic()
+        return counts
+
+    def load_snapshot(self, snapshot):
+        # a copy, so writes in this process can adjust it until the next one
+        counts = self.load(snapshot.counts)
+        with self.lock:
+            self.snapshot = snapshot
+        return counts
+
+    def add(self, category, difficulty, delta):
+        with self.lock:
+            if self.counts is not None:
+                key = (category, difficulty)
+                self.counts[key] = max(self.counts.get(key, 0) + delta, 0)
+
+    def reset(self):
+        with self.lock:
+            self.counts = None
+            self.snapshot = None
+
+    '''
+    total(category, counts) / by_category(counts)
+        answered from counts as returned by ensure_loaded, or from the
+        current counts when not given. Read under the lock, since writes
+        adjust the same dict in place.
+    '''
+
+    def total(self, category=None, counts=None):
+        with self.lock:
+            counts = self.counts if counts is None else counts
+            if category is None:
+                return sum(counts.values())
+            return sum(count for (key, difficulty), count in counts.items() if key == category)
+
+    def by_category(self, counts=None):
+        with self.lock:
+            by_category = {}
+            for (category, difficulty), count in sorted((self.counts if counts is None else counts).items(), key=str):
+                if category is None or not count:
+                    continue
+                entry = by_category.setdefault(str(category), {'total': 0, 'difficulty': {}})
+                entry['total'] += count
+                entry['difficulty'][str(difficulty)] = count
+            return by_category
+
+
+question_stats = QuestionStats()
+
+
+@on_change
+def update_question_stats(instance, action):
+    # updates (and category deletes, which null their questions' category)
+    # can move a question between counts, so they start over
+    if action in ('reset', 'update') or isinstance(instance, Category):
+        question_stats.reset()
+    elif action == 'insert':
+        question_stats.add(instance.category, instance.difficulty, 1)
+    elif action == 'delete':
+        question_stats.add(instance.category, instance.difficulty, -1)
+
+
+def get_question_stats():
+    # the current counts, loaded if missing or stale
+    snapshot = current_snapshot()
+    if snapshot is None:
+        return question_stats.ensure_loaded(current_app.config.get('QUESTION_STATS_TTL', QUESTION_STATS_TTL))
+    return question_stats.ensure_snapshot(snapshot)
+
+
+'''
+question_total(category=None)
+    number of questions, in one category if given, from the maintained counts
+'''
+
+
+def question_total(category=None):
+    return question_stats.total(category, get_question_stats())
+
+
+'''
+question_counts()
+    {'<category id>': {'total': n, 'difficulty': {'<difficulty>': n}}} for
+    every category that has questions
+'''
+
+
+def question_counts():
+    return question_stats.by_category(get_question_stats())
@@ -0,0 +1,147 @@
+'''
+Group commit for question writes
+
+With WRITE_QUEUE on, POST /questions (create) and DELETE /questions/<id>
+hand their write to one writer thread per process instead of committing it
+themselves. The writer collects the writes that arrive within
+WRITE_QUEUE_DELAY seconds (at most WRITE_QUEUE_BATCH of them), applies each
+in its own SAVEPOINT and commits the group in one transaction - one commit,
+and one fsync, for the whole group. Each request waits until its group has
+committed. A write that fails only rolls back its savepoint and fails its
+own request; the change listeners run for the rest once they are committed.
+'''
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import g, has_request_context
+
+from models import db, notify_change, Question
+
+WRITE_QUEUE = False
+WRITE_QUEUE_DELAY = 0.005
+WRITE_QUEUE_BATCH = 100
+
+
+def insert_question(question, answer, category, difficulty):
+    # the row is detached before the listeners see it, so it has to hold
+    # the stored types - the frontend sends category and difficulty as strings
+    question = Question(question=question, answer=answer, category=int(category), difficulty=int(difficulty))
+    db.session.add(question)
+    db.session.flush()
+    return question, 'insert'
+
+
+def delete_question(question_id):
+    question = Question.query.get(question_id)
+    if question is None:
+        raise LookupError(question_id)
+    db.session.delete(question)
+    db.session.flush()
+    return question, 'delete'
+
+
+class WriteQueue:
+
+    def __init__(self, app, delay=WRITE_QUEUE_DELAY, batch=WRITE_QUEUE_BATCH):
+        self.app = app
+        self.delay = delay
+        self.batch = batch
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = None
+        self.pid = None
+        self.groups = 0
+        self.operations = 0
+
+    def start(self):
+        # started on first use, and again in a forked worker, which inherits
+        # the queue but not the thread
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.queue = queue.Queue()
+                self.thread = threading.Thread(target=self.run, name='trivia-write-queue', daemon=True)
+                self.pid = os.getpid()
+                self.thread.start()
+
+    '''
+    submit(operation, *args)
+        queues operation(*args) - one of the functions above - and returns a
+        Future for the written Question, or the exception that failed it
+    '''
+
+    def submit(self, operation, *args):
+        if self.thread is None or self.pid != os.getpid():
+            self.start()
+        future = Future()
+        self.queue.put((operation, args, future))
+        return future
+
+    def run(self):
+        while True:
+            group = [self.queue.get()]
+            deadline = time.monotonic() + self.delay
+            while len(group) < self.batch:
+                try:
+                    group.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            try:
+                self.commit_group(group)
+            except Exception as error:
+                # never leave a request waiting
+                for operation, args, future in group:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def commit_group(self, group):
+        written = []
+        with self.app.app_context():
+            try:
+                for operation, args, future in group:
+                    try:
+                        with db.session.begin_nested():
+                            instance, action = operation(*args)
+                    except Exception as error:
+                        future.set_exception(error)
+                    else:
+                        written.append((future, instance, action))
+
+                # keep the written rows loaded for the listeners after commit
+                for future, instance, action in written:
+                    if action == 'insert':
+                        db.session.expunge(instance)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+            with self.lock:
+                self.groups += 1
+                self.operations += len(group)
+
+            for future, instance, action in written:
+                notify_change(instance, action)
+                future.set_result(instance)
+
+
+'''
+queued_write(app, operation, *args)
+    runs operation through the app's write queue and waits for its group to
+    commit. Returns the written Question; raises LookupError when there was
+    nothing to delete, or whatever failed the write.
+'''
+
+
+def queued_write(app, operation, *args):
+    result = app.extensions['write_queue'].submit(operation, *args).result()
+    if has_request_context():
+        # the write went through another session - the read replica routing
+        # still has to send this client to the primary for a while
+        g.db_wrote = True
+    return result
@@ -0,0 +1,103 @@
+'''
+Versioned schema migrations
+
+Each file in versions/ is named NNNN_description.py and defines
+upgrade(connection). Files that set TRANSACTIONAL = False get an autocommit
+connection so they can run online steps such as CREATE INDEX CONCURRENTLY
+and commit batched backfills as they go. Applied versions are recorded in
+the schema_migrations table.
+
+    flask db-upgrade [--target N]
+    flask db-version
+'''
+import datetime
+import importlib.util
+import logging
+import os
+import re
+
+import click
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, select
+
+from models import db
+
+VERSIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'versions')
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String),
+    Column('applied_at', DateTime)
+)
+
+
+def load_migrations():
+    migrations = []
+    for filename in sorted(os.listdir(VERSIONS_PATH)):
+        match = re.match(r'^(\d{4})_(\w+)\.py$', filename)
+        if not match:
+            continue
+        spec = importlib.util.spec_from_file_location('migrations.versions.m' + match.group(1),
+                                                      os.path.join(VERSIONS_PATH, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migrations.append((int(match.group(1)), match.group(2), module))
+    return migrations
+
+
+def current_version(engine):
+    metadata.create_all(engine, tables=[schema_migrations])
+    with engine.connect() as connection:
+        return connection.execute(select([func.max(schema_migrations.c.version)])).scalar() or 0
+
+
+'''
+upgrade(engine, target=None)
+    applies every migration newer than the recorded version, up to target,
+    and returns the versions applied
+'''
+
+
+def upgrade(engine, target=None):
+    applied = []
+
+    for version, name, module in load_migrations():
+        if version <= current_version(engine) or (target is not None and version > target):
+            continue
+
+        logger.info('Applying migration %04d_%s', version, name)
+        if getattr(module, 'TRANSACTIONAL', True):
+            with engine.begin() as connection:
+                module.upgrade(connection)
+        else:
+            with engine.connect() as connection:
+                if engine.dialect.name == 'postgresql':
+                    connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+                module.upgrade(connection)
+
+        with engine.begin() as connection:
+            connection.execute(schema_migrations.insert().values(
+                version=version, name=name, applied_at=datetime.datetime.utcnow()))
+        applied.append(version)
+
+    return applied
+
+
+def register_migration_commands(app):
+
+    @app.cli.command('db-upgrade')
+    @click.option('--target', type=int, default=None, help='Stop after this version.')
+    def upgrade_command(target):
+        '''Apply pending schema migrations.'''
+        applied = upgrade(db.engine, target)
+        click.echo('Applied {}'.format(', '.join('{:04d}'.format(version) for version in applied))
+                   if applied else 'Already up to date')
+        click.echo('Schema version {:04d}'.format(current_version(db.engine)))
+
+    @app.cli.command('db-version')
+    def version_command():
+        '''Show the applied schema version.'''
+        click.echo('Schema version {:04d}'.format(current_version(db.engine)))
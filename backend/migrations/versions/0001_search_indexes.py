@@ -0,0 +1,43 @@
+'''
+pg_trgm GIN indexes so the question search ILIKE can use an index
+
+Skipped, with a warning, where pg_trgm is not installed on the server or the
+role may not create it - the search then falls back to a plain ILIKE
+(flaskr.search), and the later migrations still apply.
+'''
+import logging
+
+TRANSACTIONAL = False
+
+logger = logging.getLogger(__name__)
+
+
+def create_extension(connection):
+    installed = connection.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").scalar()
+    if installed:
+        return True
+
+    available = connection.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").scalar()
+    if not available:
+        logger.warning('pg_trgm is not available on this server; skipping the trigram search indexes')
+        return False
+
+    try:
+        connection.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    except Exception:
+        logger.warning('Unable to create pg_trgm; skipping the trigram search indexes', exc_info=True)
+        return False
+    return True
+
+
+def upgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+
+    if not create_extension(connection):
+        return
+
+    connection.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_question_trgm '
+                       'ON questions USING gin (question gin_trgm_ops)')
+    connection.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_questions_answer_trgm '
+                       'ON questions USING gin (answer gin_trgm_ops)')
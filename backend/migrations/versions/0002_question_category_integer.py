@@ -0,0 +1,100 @@
+'''
+questions.category as an integer foreign key to categories.id, with
+(category, id) and (category, difficulty) indexes
+
+Databases created by db.create_all() before this change have a text
+category column. On Postgres it is converted online:
+
+    1. add category_int and a trigger that keeps it in step with category
+    2. backfill category_int in id-range batches, one commit each
+    3. build the new indexes CONCURRENTLY
+    4. swap the columns in one short transaction
+    5. add the foreign key NOT VALID and validate it without blocking writes
+
+Non-numeric categories become NULL. Databases that already have an integer
+column (e.g. loaded from trivia.psql) only get the indexes.
+'''
+import logging
+
+TRANSACTIONAL = False
+BATCH_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+INDEXES = (
+    ('ix_questions_category_id', 'category, id'),
+    ('ix_questions_category_difficulty', 'category, difficulty'),
+)
+
+
+def column_type(connection):
+    return connection.execute(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'questions' AND column_name = 'category'").scalar()
+
+
+def create_indexes(connection, column='category', concurrently=''):
+    for name, columns in INDEXES:
+        connection.execute('CREATE INDEX {} IF NOT EXISTS {} ON questions ({})'.format(
+            concurrently, name + ('_new' if column != 'category' else ''), columns.replace('category', column)))
+
+
+def convert_category_column(connection):
+    connection.execute('ALTER TABLE questions ADD COLUMN IF NOT EXISTS category_int integer')
+    connection.execute('''
+        CREATE OR REPLACE FUNCTION questions_sync_category_int() RETURNS trigger AS $$
+        BEGIN
+            NEW.category_int := CASE WHEN NEW.category ~ '^[0-9]+$' THEN NEW.category::integer END;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql''')
+    connection.execute('DROP TRIGGER IF EXISTS questions_sync_category_int ON questions')
+    connection.execute('CREATE TRIGGER questions_sync_category_int BEFORE INSERT OR UPDATE OF category '
+                       'ON questions FOR EACH ROW EXECUTE PROCEDURE questions_sync_category_int()')
+
+    low, high = connection.execute('SELECT min(id), max(id) FROM questions').fetchone()
+    for start in range(low or 0, (high or 0) + 1, BATCH_SIZE):
+        connection.execute(
+            "UPDATE questions SET category_int = CASE WHEN category ~ '^[0-9]+$' THEN category::integer END "
+            "WHERE id >= %(start)s AND id < %(end)s", {'start': start, 'end': start + BATCH_SIZE})
+
+    create_indexes(connection, 'category_int', 'CONCURRENTLY')
+
+    # the swap needs a real transaction, so it can't use the autocommit connection
+    with connection.engine.begin() as swap:
+        swap.execute('LOCK TABLE questions IN ACCESS EXCLUSIVE MODE')
+        swap.execute('DROP TRIGGER questions_sync_category_int ON questions')
+        swap.execute('DROP FUNCTION questions_sync_category_int()')
+        swap.execute('ALTER TABLE questions DROP COLUMN category')
+        swap.execute('ALTER TABLE questions RENAME COLUMN category_int TO category')
+        for name, columns in INDEXES:
+            swap.execute('ALTER INDEX {0}_new RENAME TO {0}'.format(name))
+
+
+def add_foreign_key(connection):
+    exists = connection.execute(
+        "SELECT 1 FROM pg_constraint WHERE conrelid = 'questions'::regclass AND contype = 'f'").scalar()
+    if exists:
+        return
+
+    connection.execute('ALTER TABLE questions ADD CONSTRAINT category FOREIGN KEY (category) '
+                       'REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL NOT VALID')
+    try:
+        connection.execute('ALTER TABLE questions VALIDATE CONSTRAINT category')
+    except Exception:
+        # still enforced for new rows - fix the orphans and re-run VALIDATE by hand
+        logger.warning('questions.category has rows without a matching category; '
+                       'the foreign key is left NOT VALID', exc_info=True)
+
+
+def upgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        # SQLite compares by column affinity, so only the indexes are needed
+        create_indexes(connection)
+        return
+
+    if column_type(connection) != 'integer':
+        convert_category_column(connection)
+
+    create_indexes(connection, concurrently='CONCURRENTLY')
+    add_foreign_key(connection)
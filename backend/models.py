@@ -1,25 +1,202 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import threading
+import time
+from flask import g, has_request_context
+from sqlalchemy import Column, String, Integer, ForeignKey, Index, create_engine, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
 database_name = "triviaapi"
-database_path = "postgres://{}/{}".format('localhost:5432', database_name)
+database_path = os.environ.get('DATABASE_URL', "postgres://{}/{}".format('localhost:5432', database_name))
+
+
+'''
+RoutingSession
+    session that sends the reads of a request to the replica engine chosen
+    for it (g.db_replica, set by the replica routing in flaskr). Flushes and
+    INSERT/UPDATE/DELETE statements always go to the primary, and once a
+    request has written (g.db_wrote) its later reads do too.
+'''
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context():
+            if self._flushing or isinstance(clause, UpdateBase):
+                g.db_wrote = True
+            elif g.get('db_replica') is not None and not g.get('db_wrote'):
+                return g.db_replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+DB_POOL_SIZE = 5
+DB_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT = 30
+DB_POOL_RECYCLE = 1800
+DB_POOL_PRE_PING = True
+DB_STATEMENT_TIMEOUT = 0
+DB_REPLICA_URLS = ''
+
+
+'''
+TimedQueuePool
+    QueuePool that records how long checkouts wait for a free connection,
+    so pool pressure shows up before requests start timing out
+'''
+
+
+class TimedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            with self.stats_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def recreate(self):
+        # keep the class (and its stats) when the pool is recreated
+        pool = super().recreate()
+        pool.checkouts = self.checkouts
+        pool.wait_seconds_total = self.wait_seconds_total
+        pool.wait_seconds_max = self.wait_seconds_max
+        return pool
+
+
+def get_setting(app, name, default, cast=str):
+    # app config first, then the environment, then the default
+    value = app.config.get(name, os.environ.get(name, default))
+    if cast is bool and isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return cast(value)
+
+
+'''
+engine_options(app, database_path)
+    SQLAlchemy engine options from DB_POOL_SIZE, DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING and DB_STATEMENT_TIMEOUT
+    (milliseconds, Postgres only). SQLite keeps its own pool. Replicas get the
+    same options, so they should run the same database as the primary.
+'''
+
+
+def engine_options(app, database_path):
+    options = {'pool_pre_ping': get_setting(app, 'DB_POOL_PRE_PING', DB_POOL_PRE_PING, bool)}
+    # the dialect name, so postgres:// URLs count as postgresql too
+    dialect = make_url(database_path).get_dialect().name
+
+    if dialect != 'sqlite':
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=get_setting(app, 'DB_POOL_SIZE', DB_POOL_SIZE, int),
+            max_overflow=get_setting(app, 'DB_MAX_OVERFLOW', DB_MAX_OVERFLOW, int),
+            pool_timeout=get_setting(app, 'DB_POOL_TIMEOUT', DB_POOL_TIMEOUT, float),
+            pool_recycle=get_setting(app, 'DB_POOL_RECYCLE', DB_POOL_RECYCLE, int),
+        )
+
+    statement_timeout = get_setting(app, 'DB_STATEMENT_TIMEOUT', DB_STATEMENT_TIMEOUT, int)
+    if statement_timeout and dialect == 'postgresql':
+        options['connect_args'] = {'options': '-c statement_timeout={}'.format(statement_timeout)}
+
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    return options
 
-db = SQLAlchemy()
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. Nothing connects to
+    the database here - the engine is created on first use. DB_CREATE_ALL
+    (on by default in development) asks the app to create missing tables
+    before its first request; production workers never pay for schema
+    reflection at boot. DB_REPLICA_URLS (comma separated) adds read replicas
+    as the binds 'replica_0', 'replica_1', ...
 '''
 
 
 def setup_db(app, database_path=database_path):
+    replica_urls = [url.strip() for url in get_setting(app, 'DB_REPLICA_URLS', DB_REPLICA_URLS).split(',') if url.strip()]
+
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config["SQLALCHEMY_BINDS"] = {'replica_{}'.format(index): url for index, url in enumerate(replica_urls)}
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app, database_path)
+    app.config["DB_CREATE_ALL"] = get_setting(app, 'DB_CREATE_ALL', app.env == 'development', bool)
     db.app = app
     db.init_app(app)
-    db.create_all()
+
+
+'''
+pool_stats()
+    connection pool utilisation for the bound engine
+'''
+
+
+def pool_stats():
+    pool = db.engine.pool
+    stats = {'pool': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+            max_overflow=pool._max_overflow
+        )
+
+    if isinstance(pool, TimedQueuePool):
+        stats.update(
+            checkouts=pool.checkouts,
+            wait_seconds_total=round(pool.wait_seconds_total, 6),
+            wait_seconds_max=round(pool.wait_seconds_max, 6)
+        )
+
+    return stats
+
+
+'''
+on_change(listener)
+    registers listener(instance, action) to be called once an insert, update
+    or delete of a Question or Category has been committed, so in-process
+    caches and indexes can keep themselves fresh. Bulk writes that bypass the
+    models call it with (None, 'reset') so everything is rebuilt.
+'''
+
+change_listeners = []
+
+
+def on_change(listener):
+    if listener not in change_listeners:
+        change_listeners.append(listener)
+    return listener
+
+
+def notify_change(instance, action):
+    for listener in change_listeners:
+        listener(instance, action)
 
 
 '''
@@ -34,9 +211,15 @@ class Question(db.Model):
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id', name='category', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
+    # category listings and quiz draws become index range scans
+    __table_args__ = (
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+    )
+
     def __init__(self, question, answer, category, difficulty):
         self.question = question
         self.answer = answer
@@ -46,13 +229,16 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_change(self, 'insert')
 
     def update(self):
         db.session.commit()
+        notify_change(self, 'update')
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        notify_change(self, 'delete')
 
     def format(self):
         return {
@@ -79,6 +265,20 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        notify_change(self, 'insert')
+
+    def update(self):
+        db.session.commit()
+        notify_change(self, 'update')
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+        notify_change(self, 'delete')
+
     def format(self):
         return {
             'id': self.id,
@@ -1,22 +1,60 @@
+import gzip
 import os
+import tempfile
+import threading
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
 
+from flask import Flask
+from sqlalchemy import create_engine, event
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.response_cache import SingleFlight
+from flaskr.search import text_index
+from flaskr.snapshot import current_snapshot, write_snapshot, Snapshot
+from flaskr.stats import get_question_stats, question_stats
+from migrations import current_version, upgrade
+from models import db, engine_options, notify_change, Question, Category
+
+try:
+    from starlette.testclient import TestClient
+    from flaskr.asgi import create_asgi_app
+except ImportError:
+    # the async serving mode is optional (requirements-async.txt)
+    create_asgi_app = None
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    database_name = "triviaapi"
+    database_path = os.environ.get('TEST_DATABASE_URL', "postgres://{}/{}".format('localhost:5432', database_name))
+
+    @classmethod
+    def setUpClass(cls):
+        """Create one app for the whole run."""
+        cls.app = create_app({'SQLALCHEMY_DATABASE_URI': cls.database_path})
+
     def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
+        """Run each test in a transaction that is rolled back afterwards."""
         self.client = self.app.test_client
-        self.database_name = "triviaapi"
-        self.database_path = "postgres://{}/{}".format('localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
+
+        # every session the app opens during the test shares this connection,
+        # so commits inside the app only commit into the outer transaction
+        with self.app.app_context():
+            self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.app_session = db.session
+        db.session = db.create_scoped_session(options={'bind': self.connection, 'binds': {}})
+
+        # a rollback inside the app rolls back to this SAVEPOINT, which is
+        # then started again, so it never ends the outer transaction
+        self.nested = self.connection.begin_nested()
+
+        @event.listens_for(db.session, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if not self.nested.is_active:
+                self.nested = self.connection.begin_nested()
 
         self.new_question = {
             'question': 'Why do birds suddenly appear, every time you are near?',
@@ -67,21 +105,132 @@ class TriviaTestCase(unittest.TestCase):
             'quiz_category':'Geography'
         }
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        db.session.remove()
+        db.session = self.app_session
+        self.nested.rollback()
+        self.transaction.rollback()
+        self.connection.close()
+
+        # drop whatever in-process caches learnt from the rolled back writes
+        with self.app.app_context():
+            notify_change(None, 'reset')
 
     """
     TODO
     Write at least one test for each test for successful operation and for expected errors.
     """
+    # HEALTH
+    def test_health(self):
+        res = self.client().get('/health')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['database'], 'ok')
+        self.assertIn('checked_out', data['pool']) # Check pool utilisation is reported
+
+    def test_statement_timeout_for_postgres_urls(self):
+        app = Flask(__name__)
+        app.config['DB_STATEMENT_TIMEOUT'] = 5000
+
+        for url in ('postgres://localhost:5432/triviaapi', 'postgresql+psycopg2://localhost:5432/triviaapi'):
+            options = engine_options(app, url)
+            self.assertIn('statement_timeout', options['connect_args']['options']) # Check both URL spellings get the timeout
+
+    # MIGRATIONS
+    @unittest.skipUnless(database_path.startswith('postgres'), 'the trigram indexes are Postgres only')
+    def test_migrations_apply_without_pg_trgm(self):
+        engine = create_engine(self.database_path)
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def refuse_extensions(connection, cursor, statement, parameters, context, executemany):
+            # as on a server where the role may not create pg_trgm
+            if statement.startswith('CREATE EXTENSION'):
+                raise PermissionError('permission denied to create extension "pg_trgm"')
+
+        try:
+            engine.execute('DROP TABLE IF EXISTS schema_migrations')
+            applied = upgrade(engine)
+
+            self.assertIn(1, applied) # Check the search index migration is recorded without its indexes
+            self.assertIn(2, applied) # Check the integer category migration still applies
+            self.assertEqual(current_version(engine), max(applied))
+        finally:
+            engine.dispose()
+
+    # READ REPLICAS - point TEST_REPLICA_DATABASE_URL at a second database with the same schema
+    @unittest.skipUnless(os.environ.get('TEST_REPLICA_DATABASE_URL'), 'no replica database configured')
+    def test_read_replica_routing(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'DB_REPLICA_URLS': os.environ.get('TEST_REPLICA_DATABASE_URL')})
+        client = app.test_client()
+        replicas = app.extensions['db_replicas']
+
+        res = client.get('/categories')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(replicas.stats()['replica_0']['requests'], 1) # Check reads are sent to the replica
+
+        res = client.post('/questions', json=self.new_question)
+        self.assertIn('trivia_primary=', res.headers.get('Set-Cookie', '')) # Check a write pins the client to the primary
+
+        client.get('/categories')
+        self.assertEqual(replicas.stats()['replica_0']['requests'], 2) # Check reads after a write skip the replica
+
+    @unittest.skipUnless(os.environ.get('TEST_REPLICA_DATABASE_URL'), 'no replica database configured')
+    def test_read_your_writes_skips_response_cache(self):
+        # the replica never sees the writes this test makes - a lagging replica
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'DB_REPLICA_URLS': os.environ.get('TEST_REPLICA_DATABASE_URL')})
+        writer, reader = app.test_client(), app.test_client()
+
+        created = json.loads(writer.post('/questions', json=self.new_question).data)['created']
+        reader.get('/questions?per_page=100')
+        res = writer.get('/questions?per_page=100')
+        ids = [question['id'] for question in json.loads(res.data)['questions']]
+
+        self.assertIn(created, ids) # Check the writer reads its write, not a page cached from the replica
+
+    # ASYNC APP - needs the packages in requirements-async.txt and a Postgres database
+    @unittest.skipUnless(create_asgi_app is not None and database_path.startswith('postgres'),
+                         'async requirements not installed or not a Postgres database')
+    def test_asgi_app_matches_flask_routes(self):
+        requests = [
+            ('GET', '/categories', None),
+            ('GET', '/questions?page=2', None),
+            ('GET', '/questions?limit=5', None),
+            ('GET', '/categories/1/questions', None),
+            ('GET', '/categories/1000/questions', None),
+            ('POST', '/questions', {'searchTerm': 'oCCe'}),
+            ('POST', '/questions', {'searchTerm': 'kerffuffelump'}),
+            ('POST', '/questions', self.new_question_missing_data),
+            ('POST', '/quizzes', self.quiz_example_1),
+            ('POST', '/quizzes', self.quiz_example_2),
+            ('POST', '/quizzes', self.quiz_example_4),
+            ('POST', '/quizzes', {'previous_questions': [10], 'quiz_category': {'type': 'click', 'id': 6},
+                                  'adaptive': True, 'difficulty': 1, 'recent_answers': []}),
+            ('DELETE', '/questions/09879876', None),
+        ]
+
+        # read-only requests - the async app's writes would not be rolled back
+        with TestClient(create_asgi_app({'SQLALCHEMY_DATABASE_URI': self.database_path})) as asgi_client:
+            for method, url, body in requests:
+                expected = self.client().open(url, method=method, json=body)
+                res = asgi_client.request(method, url, json=body)
+
+                self.assertEqual(res.status_code, expected.status_code, url)
+                self.assertEqual(res.json(), json.loads(expected.data), url) # Check both apps return the same JSON
+
+    # METRICS
+    def test_metrics(self):
+        self.client().get('/questions')
+        res = self.client().get('/metrics')
+        body = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_requests_total{method="GET",route="/questions",status="200"}', body) # Check the request was counted
+        self.assertIn('trivia_request_sql_queries_count{method="GET",route="/questions"}', body) # Check its SQL was counted
+
     # GET CATEGORIES
     def test_retrieve_categories(self):
         # test request path
@@ -93,6 +242,24 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True) # Check json success = true
         self.assertEqual(data['total_categories'], 6) # Check total categories = 6
 
+    def test_retrieve_category_question_counts(self):
+        data = json.loads(self.client().get('/categories').data)
+        questions = json.loads(self.client().get('/questions').data)
+
+        self.assertEqual(data['total_questions'], questions['total_questions']) # Check the maintained total matches the listing
+        self.assertEqual(sum(counts['total'] for counts in data['question_counts'].values()), data['total_questions']) # Check per category counts add up
+
+    def test_counts_and_search_survive_a_concurrent_reset(self):
+        with self.app.app_context():
+            counts = get_question_stats()
+            loaded = text_index.ensure_loaded(60, False)
+            # as a write from another thread would between loading and reading
+            notify_change(None, 'reset')
+
+            self.assertTrue(question_stats.total(None, counts)) # Check the loaded counts are still answered from
+            self.assertTrue(question_stats.by_category(counts))
+            self.assertTrue(text_index.search('occe', loaded)) # Check the loaded search index is still searched
+
     # Can't test for this as the data is statically held in the table. The only failure is if the data is unavailable.
     # def test_500_sent_requesting_category_list(self):
     #     res = self.client().get('/categories')
@@ -113,6 +280,101 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['current_category']) # Check current_category var is populated
         self.assertTrue(data['categories']) # Check categories var is populated
 
+    def test_retrieve_questions_custom_page_size(self):
+        res = self.client().get('/questions?page=1&per_page=5')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 5) # Check page size honours per_page
+        self.assertTrue(data['total_questions'] > 5) # Check total is counted across all pages
+
+    def test_retrieve_questions_after_update(self):
+        first = json.loads(self.client().get('/questions').data)['questions'][0]
+
+        with self.app.app_context():
+            question = Question.query.get(first['id'])
+            question.answer = 'Updated answer'
+            question.update()
+        data = json.loads(self.client().get('/questions').data)
+        with self.app.app_context():
+            question = Question.query.get(first['id'])
+            question.answer = first['answer']
+            question.update()
+
+        self.assertEqual(data['questions'][0]['answer'], 'Updated answer') # Check cached question JSON was dropped
+
+    def test_retrieve_questions_with_cursor(self):
+        res = self.client().get('/questions?limit=5')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 5)
+        self.assertTrue(data['next_cursor']) # Check a cursor is handed back for the next page
+
+        res = self.client().get('/questions?limit=5&after=' + data['next_cursor'])
+        next_page = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(next_page['questions'][0]['id'] > data['questions'][-1]['id']) # Check the page continues after the cursor
+
+    def test_400_sent_requesting_questions_with_bad_cursor(self):
+        res = self.client().get('/questions?after=not-a-cursor')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_304_sent_for_unchanged_question_list(self):
+        res = self.client().get('/questions')
+        etag = res.headers.get('ETag')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(etag) # Check read responses carry an ETag
+
+        res = self.client().get('/questions', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304) # Check an unchanged page is not resent
+
+    def test_compressed_question_list(self):
+        plain = self.client().get('/questions')
+        res = self.client().get('/questions', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers.get('Content-Encoding'), 'gzip')
+        self.assertIn('Accept-Encoding', res.headers.get('Vary')) # Check caches keep the encodings apart
+        self.assertEqual(gzip.decompress(res.data), plain.data) # Check the same body is sent compressed
+
+        res = self.client().get('/questions', headers={'Accept-Encoding': 'gzip', 'If-None-Match': res.headers.get('ETag')})
+        self.assertEqual(res.status_code, 304) # Check the compressed body's ETag revalidates
+
+    def test_concurrent_cache_misses_render_once(self):
+        flights = SingleFlight()
+        rendering = threading.Event()
+        finish = threading.Event()
+        renders = []
+        entries = []
+
+        def render():
+            renders.append(1)
+            rendering.set()
+            finish.wait(5)
+            return ('etag', b'{}', 'application/json')
+
+        threads = [threading.Thread(target=lambda: entries.append(flights.run('/questions?page=1', render)))
+                   for caller in range(5)]
+        threads[0].start()
+        rendering.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.1)
+        finish.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(renders), 1) # Check only one caller rendered the page
+        self.assertEqual(len(set(entries)), 1) # Check every caller got its result
+        self.assertEqual(flights.coalesced, 4)
+
     def test_404_sent_requesting_question_list(self):
         res = self.client().get('/questions?page=77')
         data = json.loads(res.data)
@@ -126,6 +388,16 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post('/questions', json=self.new_question)
         data = json.loads(res.data)
 
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['created']) # Check the new question id is returned
+        self.assertNotIn('questions', data) # Check the lean response skips the re-listing
+        self.assertTrue(data['total_questions'])
+
+    def test_create_question_full_response(self):
+        res = self.client().post('/questions?full=1', json=self.new_question)
+        data = json.loads(res.data)
+
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(data['created'])
@@ -148,8 +420,15 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'The request was valid, but there was an issue during processing. Data may be out of range. Please consult the documentation and resubmit.')
 
+    def test_app_rollback_keeps_test_transaction(self):
+        self.client().post('/questions', json=self.new_question_data_out_of_range)
+        res = self.client().post('/questions', json=self.new_question)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(self.transaction.is_active) # Check the write after the app's rollback is still rolled back
+
     def test_404_sent_creating_new_question(self):
-        res = self.client().post('/questions?page=77', json=self.new_question)
+        res = self.client().post('/questions?page=77&full=1', json=self.new_question)
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 404)
@@ -166,6 +445,16 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(len(data['questions']))
         self.assertTrue(data['total_questions'])
 
+    def test_search_questions_without_trigrams(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'SEARCH_BACKEND': 'ilike'})
+        res = app.test_client().post('/questions', json=({'searchTerm': 'oCCe'}))
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(len(ids))
+        self.assertEqual(ids, sorted(ids)) # Check the plain ILIKE search is in id order
+
     def test_404_no_search_results_found(self):
         res = self.client().post('/questions', json=({'searchTerm': 'kerffuffelump'}))
         data = json.loads(res.data)
@@ -174,6 +463,26 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'The requested resource could not be found.')
 
+# BULK IMPORT / EXPORT
+    def test_import_questions(self):
+        lines = '\n'.join([json.dumps(self.new_question), json.dumps(self.new_question_missing_data), '{not json'])
+        res = self.client().post('/questions/import', data=lines, content_type='application/x-ndjson')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['imported'], 1) # Check the valid row is inserted
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3]) # Check bad rows are reported, not fatal
+
+    def test_export_questions(self):
+        res = self.client().get('/questions/export')
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(len(lines))
+        self.assertTrue(json.loads(lines[0])['question']) # Check each line is a question record
+
 # DELETE QUESTIONS
     def test_delete_question(self):
         res = self.client().delete('/questions/5')
@@ -181,7 +490,7 @@ class TriviaTestCase(unittest.TestCase):
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
-        self.assertTrue(len(data['questions']))
+        self.assertEqual(data['deleted'], 5)
         self.assertTrue(data['total_questions'])
 
     def test_404_question_not_found(self):
@@ -200,6 +509,38 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Method not allowed - please use an appropriate method with your request, or add a resource.')
 
+    def test_create_and_delete_question_through_write_queue(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'WRITE_QUEUE': True})
+        client = app.test_client()
+
+        res = client.post('/questions', json=self.new_question)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['created']) # Check the new id is returned once its group has committed
+
+        res = client.post('/questions', json=self.new_question_data_out_of_range)
+        self.assertEqual(res.status_code, 422) # Check a failed write only fails its own request
+
+        res = client.delete('/questions/{}'.format(data['created']))
+        self.assertEqual(res.status_code, 200)
+
+        res = client.delete('/questions/{}'.format(data['created']))
+        self.assertEqual(res.status_code, 404) # Check a queued delete of a missing question is a 404
+
+    def test_write_queue_stores_form_strings_as_integers(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'WRITE_QUEUE': True})
+        client = app.test_client()
+        total = json.loads(client.get('/categories/1/questions').data)['total_questions']
+
+        # the React form sends its <select> values as strings
+        res = client.post('/questions', json=dict(self.new_question, category='1', difficulty='2'))
+        self.assertEqual(res.status_code, 200)
+        data = json.loads(client.get('/categories/1/questions').data)
+        self.assertEqual(data['total_questions'], total + 1) # Check the maintained count moved for category 1
+
+        res = client.post('/questions', json=dict(self.new_question, category='one'))
+        self.assertEqual(res.status_code, 422)
+
 # # GET QUESTIONS BY CATEGORY
     def test_get_questions_by_category(self):
         res = self.client().get('/categories/1/questions')
@@ -228,6 +569,117 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(len(data['question']))
 
+    def test_retrieve_next_quiz_question_all_categories(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'type': 'click', 'id': 0}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(len(data['question']))
+
+    def test_retrieve_next_quiz_questions_batch(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'type': 'click', 'id': 0}, 'count': 5})
+        data = json.loads(res.data)
+        ids = [question['id'] for question in data['questions']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5) # Check the batch has no repeats
+        self.assertEqual(data['question'], data['questions'][0])
+
+    def test_retrieve_next_adaptive_quiz_question(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'type': 'click', 'id': 0},
+                                                   'adaptive': True, 'difficulty': 2, 'recent_answers': [True, True, True, True, True]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['difficulty'], 3) # Check a run of correct answers moves up a band
+        self.assertTrue(data['question'])
+
+    def test_retrieve_next_adaptive_quiz_question_from_nearest_band(self):
+        res = self.client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'type': 'click', 'id': 6},
+                                                   'adaptive': True, 'difficulty': 1, 'recent_answers': []})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['difficulty'], 1)
+        self.assertEqual(data['served_difficulty'], 3) # Check the band served is reported when the target is empty
+        self.assertEqual(data['question']['difficulty'], 3)
+
+    def test_retrieve_next_quiz_question_from_shared_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                              'SNAPSHOT_PATH': os.path.join(directory, 'snapshot.bin')})
+            res = app.test_client().post('/quizzes', json={'previous_questions': [], 'quiz_category': {'type': 'click', 'id': 0}})
+            data = json.loads(res.data)
+
+            self.assertTrue(os.path.exists(app.config['SNAPSHOT_PATH'])) # Check the snapshot was published on start
+            self.assertEqual(res.status_code, 200)
+            self.assertTrue(data['question'])
+
+    def test_404_snapshot_quiz_category_exhausted_after_delete(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                              'SNAPSHOT_PATH': os.path.join(directory, 'snapshot.bin')})
+            client = app.test_client()
+
+            self.assertEqual(client.delete('/questions/11').status_code, 200)
+            res = client.post('/quizzes', json={'previous_questions': [10], 'quiz_category': {'type': 'Sports', 'id': 6}})
+            self.assertEqual(res.status_code, 404) # Check a seen id plus a masked delete empties the bucket
+
+            self.assertEqual(client.delete('/questions/22').status_code, 200)
+            res = client.post('/quizzes', json={'previous_questions': [20, 21], 'quiz_category': {'type': 'Science', 'id': 1}})
+            self.assertEqual(res.status_code, 404)
+
+    def test_snapshot_rebuilt_on_start(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'snapshot.bin')
+            write_snapshot(path, 7, {}, [], {})
+            create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'SNAPSHOT_PATH': path})
+            snapshot = Snapshot(path)
+
+            self.assertEqual(snapshot.version, 8) # Check a file left from an earlier run is not trusted
+            self.assertTrue(snapshot.counts)
+
+    def test_stale_snapshot_is_not_used_and_rebuilt(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'snapshot.bin')
+            app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path, 'SNAPSHOT_PATH': path,
+                              'SNAPSHOT_CHECK_SECONDS': 0, 'SNAPSHOT_MAX_AGE': 60})
+            published = Snapshot(path).version
+            os.utime(path, (time.time() - 120,) * 2)
+
+            with app.app_context():
+                self.assertIsNone(current_snapshot()) # Check readers fall back to the database past the max age
+
+                deadline = time.monotonic() + 10
+                snapshot = None
+                while snapshot is None and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                    snapshot = current_snapshot()
+
+            self.assertEqual(snapshot.version, published + 1) # Check a worker rebuilt it
+
+    def test_import_questions_command_republishes_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                              'SNAPSHOT_PATH': os.path.join(directory, 'snapshot.bin')})
+            published = Snapshot(app.config['SNAPSHOT_PATH'])
+            path = os.path.join(directory, 'questions.ndjson')
+            with open(path, 'w') as out:
+                out.write(json.dumps(self.new_question) + '\n')
+
+            result = app.test_cli_runner().invoke(args=['import-questions', path])
+            snapshot = Snapshot(app.config['SNAPSHOT_PATH'])
+
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('Imported 1 questions', result.output)
+            self.assertEqual(snapshot.version, published.version + 1) # Check the import republished before exiting
+            self.assertEqual(sum(count for category, difficulty, count in snapshot.counts),
+                             sum(count for category, difficulty, count in published.counts) + 1)
+
     def test_404_next_quiz_question_not_found(self):
         res = self.client().post('/quizzes', json=self.quiz_example_2)
         data = json.loads(res.data)
@@ -245,6 +697,30 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'The request was valid, but there was an issue during processing. Data may be out of range. Please consult the documentation and resubmit.')
 
 
+    def test_quiz_session_serves_each_question_once(self):
+        res = self.client().post('/quizzes/sessions', json={'quiz_category': {'type': 'Geography', 'id': 3}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['session'])
+
+        seen = []
+        for step in range(data['total_questions']):
+            res = self.client().post('/quizzes/sessions/{}/next'.format(data['session']))
+            seen.append(json.loads(res.data)['question']['id'])
+
+        self.assertEqual(len(seen), len(set(seen))) # Check no question was repeated
+        res = self.client().post('/quizzes/sessions/{}/next'.format(data['session']))
+        self.assertEqual(res.status_code, 404) # Check the session ends once it runs out
+
+    def test_404_quiz_session_not_found(self):
+        res = self.client().post('/quizzes/sessions/not-a-session/next')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
     def test_400_sent_json_sent_for_quiz_questions_not_formatted_correctly(self):
         res = self.client().post('/quizzes', json=self.quiz_example_4)
         data = json.loads(res.data)
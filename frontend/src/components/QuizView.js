@@ -10,7 +10,9 @@ class QuizView extends Component {
     super();
     this.state = {
         quizCategory: null,
+        quizSession: null,
         previousQuestions: [], 
+        prefetchedQuestions: [],
         showAnswer: false,
         categories: {},
         numCorrect: 0,
@@ -36,41 +38,85 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    this.setState({quizCategory: {type, id}}, this.startSession)
+  }
+
+  startSession = () => {
+    $.ajax({
+      url: '/quizzes/sessions', //TODO: update request URL
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        quiz_category: this.state.quizCategory
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({ quizSession: result.session }, this.getNextQuestion)
+        return;
+      },
+      error: (error) => {
+        this.setState({ forceEnd: true })
+        return;
+      }
+    })
   }
 
   handleChange = (event) => {
     this.setState({[event.target.name]: event.target.value})
   }
 
+  showQuestion = (previousQuestions, [question, ...prefetchedQuestions]) => {
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      prefetchedQuestions: prefetchedQuestions,
+      currentQuestion: question,
+      guess: '',
+      forceEnd: question ? false : true
+    })
+  }
+
   getNextQuestion = () => {
     const previousQuestions = [...this.state.previousQuestions]
     if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
 
+    if(previousQuestions.length === questionsPerPlay) {
+      this.setState({ previousQuestions: previousQuestions })
+      return;
+    }
+
+    // the rest of the play is fetched with the first question
+    if(this.state.prefetchedQuestions.length) {
+      this.showQuestion(previousQuestions, this.state.prefetchedQuestions)
+      return;
+    }
+
     $.ajax({
-      url: '/quizzes', //TODO: update request URL
+      url: `/quizzes/sessions/${this.state.quizSession}/next`, //TODO: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
+        count: questionsPerPlay - previousQuestions.length
       }),
       xhrFields: {
         withCredentials: true
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true
-        })
+        this.showQuestion(previousQuestions, result.questions)
         return;
       },
       error: (error) => {
+        if (error.status === 404) {
+          // the session has run out of questions
+          this.setState({ previousQuestions: previousQuestions, forceEnd: true })
+          return;
+        }
         alert('Unable to load question. Please try your request again')
         return;
       }
@@ -90,7 +136,9 @@ class QuizView extends Component {
   restartGame = () => {
     this.setState({
       quizCategory: null,
+      quizSession: null,
       previousQuestions: [], 
+      prefetchedQuestions: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},